@@ -1,7 +1,7 @@
 import tkinter as tk
-import os, json
+import os, json, time
 from tkinter import filedialog, BooleanVar, messagebox
-import subprocess
+import subprocess, threading, queue, tempfile
 from customtkinter import CTkButton, CTkCheckBox, CTk, CTkFrame, CTkScrollableFrame
 all_files = []
 
@@ -11,14 +11,23 @@ config_directory = "\\config"
 with open(directory + config_directory + "\\misc_config.json") as f:
     misc_config = json.load(f)
 
+# the run stops at the next batch once this file exists (--cancelFile of create_dynamic_catalog.py)
+cancel_filepath = os.path.join(tempfile.gettempdir(), f"create_dynamic_catalog_{os.getpid()}.cancel")
+# lines of output shown in the window and in the result dialog
+output_lines = 15
+
 def main():
     global all_files
     root = CTk()  
     root.title("Config File Selector")
-    root.geometry("600x550") 
+    root.geometry("600x850") 
 
     read_parent_catalog_var = BooleanVar(value=True)
     generate_test_node_var = BooleanVar(value=True)
+    parallel_var = BooleanVar(value=False)
+
+    # the running generation: process, queue of its output lines and the progress per collection
+    run_state = {"process": None, "output": queue.Queue(), "lines": [], "progress": {}}
 
     def select_files():
         global all_files
@@ -94,50 +103,159 @@ def main():
                                               text_color="#000000")
     generate_test_node_checkbox.grid(row=2, column=0, pady=10)
 
+    parallel_checkbox = CTkCheckBox(root,
+                                    text="Process collections in parallel",
+                                    variable=parallel_var,
+                                    onvalue=True,
+                                    offvalue=False,
+                                    fg_color="#007bff",
+                                    hover_color="#0056b3",
+                                    text_color="#000000")
+    parallel_checkbox.grid(row=3, column=0, pady=10)
+
     def execute_command(execute_button):
+        if run_state["process"] is not None:
+            return
         if all_files:
         
-            execute_button.configure(text=f"Generating collection(s) from {len(all_files)} file(s)")
-            execute_button.update()
-            base_command = [
-                misc_config["python_path"],
-                '"create_dynamic_catalog.py"'
+            execute_button.configure(text=f"Generating collection(s) from {len(all_files)} file(s)", state=tk.DISABLED)
+            # -u: output is read line by line while the script runs
+            command = [
+                misc_config["python_path"], "-u",
+                "create_dynamic_catalog.py",
+                "--readParentCatalog", str(read_parent_catalog_var.get()),
+                "--testMode", str(generate_test_node_var.get()),
+                "--progress", "True",
+                "--cancelFile", cancel_filepath
             ]
-            
-            if read_parent_catalog_var.get():
-                base_command.append('--readParentCatalog True')
-            else:
-                base_command.append('--readParentCatalog False')
-            
-            if generate_test_node_var.get():
-                base_command.append('--testMode True')
-            else:
-                base_command.append('--testMode False')
-
-            config_args = f'--configs {" ".join(all_files)}'
-            full_command = ' '.join(base_command + [config_args])
-            
-            print(full_command)
-            result = subprocess.run(full_command, shell=True, capture_output=True, text=True)
-            print(result.stdout)
-            print(result.stderr)
+            if parallel_var.get():
+                command += ["--workers", str(os.cpu_count())]
+            command += ["--configs"] + all_files
+            print(command)
 
-            show_result_dialog(result.stdout, result.stderr)
-            execute_button.configure(text="Generate")
+            if os.path.exists(cancel_filepath):
+                os.remove(cancel_filepath)
+            run_state["lines"] = []
+            run_state["progress"] = {}
+            run_state["process"] = subprocess.Popen(command, cwd=directory, stdout=subprocess.PIPE,
+                                                    stderr=subprocess.STDOUT, text=True, bufsize=1)
+            threading.Thread(target=read_output, args=(run_state["process"], run_state["output"]), daemon=True).start()
+            cancel_button.configure(text="Cancel", state=tk.NORMAL)
+            root.after(200, poll_output)
 
         else:
             print("Please select at least one config file.")
             messagebox.showwarning("No Files Selected", "Please select at least one config file.")
 
+    def poll_output():
+        finished = False
+        while True:
+            try:
+                line = run_state["output"].get_nowait()
+            except queue.Empty:
+                break
+            if line is None:
+                finished = True
+                break
+            if line.startswith("PROGRESS "):
+                update_progress(run_state["progress"], json.loads(line[len("PROGRESS "):]))
+            else:
+                print(line)
+                run_state["lines"] = (run_state["lines"] + [line])[-output_lines:]
+        set_text(progress_area, format_progress(run_state["progress"]))
+        set_text(output_area, "\n".join(run_state["lines"]))
+        if finished:
+            finish_command()
+        else:
+            root.after(200, poll_output)
+
+    def finish_command():
+        returncode = run_state["process"].wait()
+        cancelled = returncode != 0 and os.path.exists(cancel_filepath)
+        run_state["process"] = None
+        if os.path.exists(cancel_filepath):
+            os.remove(cancel_filepath)
+        execute_button.configure(text="Generate", state=tk.NORMAL)
+        cancel_button.configure(text="Cancel", state=tk.DISABLED)
+
+        stderr = ""
+        if cancelled:
+            stderr = "Run cancelled"
+        elif returncode != 0:
+            stderr = f"Generation failed (exit code {returncode})"
+        show_result_dialog("\n".join(run_state["lines"]), stderr)
+
+    def cancel_command():
+        if run_state["process"] is None:
+            return
+        if not os.path.exists(cancel_filepath):
+            # the script stops at the next batch, a second click stops the process at once
+            open(cancel_filepath, "w").close()
+            cancel_button.configure(text="Stop now")
+        else:
+            run_state["process"].terminate()
+
     execute_button = CTkButton(root, text="Generate", command = lambda: execute_command(execute_button),
                                fg_color="#007bff",
                                hover_color="#0056b3",
                                text_color="#ffffff",
                                border_width=0)
-    execute_button.grid(row=3, column=0, pady=20)
+    execute_button.grid(row=4, column=0, pady=10)
 
+    cancel_button = CTkButton(root, text="Cancel", command = cancel_command,
+                              state=tk.DISABLED,
+                              fg_color="#787878",
+                              hover_color="#676767",
+                              text_color="#ffffff",
+                              border_width=0)
+    cancel_button.grid(row=5, column=0, pady=10)
+
+    progress_area = tk.Text(root, height=6, width=75, state=tk.DISABLED)
+    progress_area.grid(row=6, column=0, padx=20, pady=5)
+
+    output_area = tk.Text(root, height=8, width=75, state=tk.DISABLED)
+    output_area.grid(row=7, column=0, padx=20, pady=5)
+
+    def on_close():
+        if run_state["process"] is not None:
+            run_state["process"].terminate()
+        root.destroy()
+
+    root.protocol("WM_DELETE_WINDOW", on_close)
     root.mainloop()
 
+def read_output(process, output):
+    # runs in a background thread, the lines are shown by poll_output on the Tk thread
+    for line in process.stdout:
+        output.put(line.rstrip("\n"))
+    output.put(None)
+
+def update_progress(progress, p):
+    # rows/s and ETA are measured from the first progress line of a collection
+    now = time.perf_counter()
+    entry = progress.setdefault(p["id"], {"started": now, "first_rows": p["rows"]})
+    entry.update(p)
+    entry["seconds"] = now - entry["started"]
+
+def format_progress(progress):
+    lines = []
+    for coll_id, p in progress.items():
+        rows_per_second = (p["rows"] - p["first_rows"]) / p["seconds"] if p["seconds"] > 0 else 0
+        line = f"{coll_id}: {p['rows']}"
+        if p["total"] is not None:
+            line += f"/{p['total']}"
+        line += f" rows, {p['documents']} items indexed, {rows_per_second:.0f} rows/s"
+        if p["total"] is not None and rows_per_second > 0 and p["rows"] < p["total"]:
+            line += f", ETA {(p['total'] - p['rows']) / rows_per_second:.0f} s"
+        lines.append(line)
+    return "\n".join(lines)
+
+def set_text(text_area, text):
+    text_area.config(state=tk.NORMAL)
+    text_area.delete('1.0', tk.END)
+    text_area.insert(tk.END, text)
+    text_area.config(state=tk.DISABLED)
+
 def show_result_dialog(stdout, stderr):
     result_message = ""
     title = "Result"
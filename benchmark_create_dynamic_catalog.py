@@ -0,0 +1,309 @@
+import json, argparse
+import os, sys
+import shutil
+import math
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import shapely.wkb
+import shapely.geometry
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+import create_dynamic_catalog as cdc
+
+# Offline benchmark of create_dynamic_catalog.py: a synthetic table in SQLite and a local HTTP stand-in
+# for solr (and the STAC API) replace PostGIS and solr, the pipeline runs unchanged in this process.
+
+stages = ["select", "convert", "item build", "summarize", "serialize", "index"]
+srids = [31258, 31259, 32633]
+sensors = ["ADS100", "UCE", "DMC", "ADS40"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark create_dynamic_catalog.py without outside services')
+    parser.add_argument('--rows', type=int, default=20000, help='Number of rows of the synthetic table')
+    parser.add_argument('--collections', type=int, default=2, help='Number of collections the rows are split into')
+    parser.add_argument('--vertices', type=int, default=5, help='Number of vertices of every polygon (geometry complexity)')
+    parser.add_argument('--streaming', type=lambda x: bool(cdc.strtobool(x)), default=False, help='Stream rows from db to solr in chunks')
+    parser.add_argument('--chunkSize', type=int, default=cdc.chunk_size, help='Number of rows per chunk in streaming mode')
+    parser.add_argument('--pushdown', type=lambda x: bool(cdc.strtobool(x)), default=False, help='Compute extent and summaries in the db')
+    parser.add_argument('--solrWriters', type=int, default=1, help='Number of threads sending batches to solr (solr_writers)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic data')
+    parser.add_argument('--json', help='Also write the results to this json file (e.g. to compare runs)')
+    return parser.parse_args()
+
+### SYNTHETIC DATA ###
+
+def create_polygon(x, y, vertices):
+    # closed ring of roughly 1 x 1 km around (x, y), a little irregular so no two polygons are the same
+    ring = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = 0.005 * (1 + random.random() * 0.2)
+        ring.append((x + r * math.cos(angle), y + r * math.sin(angle)))
+    return shapely.geometry.Polygon(ring)
+
+def create_table(db_filepath, rows, collections, vertices):
+    con = sqlite3.connect(db_filepath)
+    con.execute("CREATE TABLE images (image_id text, geom text, srid int, start_time timestamp, end_time timestamp, "
+                "sensor text, los_name text, folder text, filename text, coll int, last_change int)")
+    start = datetime(2015, 1, 1)
+    batch = []
+    for i in range(rows):
+        x, y = 9.5 + random.random() * 7.5, 46.4 + random.random() * 2.5
+        flown = start + timedelta(days=random.randint(0, 3000), seconds=random.randint(0, 86400))
+        batch.append((f"img{i:08d}", shapely.wkb.dumps(create_polygon(x, y, max(vertices, 3)), hex=True), random.choice(srids),
+                      flown.strftime("%Y-%m-%d %H:%M:%S"), (flown + timedelta(minutes=30)).strftime("%Y-%m-%d %H:%M:%S"),
+                      random.choice(sensors), f"los{i % 250}", f"{i % 100:03d}/", f"img{i:08d}", i % collections, i))
+        if len(batch) == 10000:
+            con.executemany("INSERT INTO images VALUES (?,?,?,?,?,?,?,?,?,?,?)", batch)
+            batch = []
+    con.executemany("INSERT INTO images VALUES (?,?,?,?,?,?,?,?,?,?,?)", batch)
+    con.commit()
+    con.close()
+
+def get_collection_config_file(collections):
+    return {
+        "config_file_name": "benchmark",
+        "collection_template": {
+            "ignore_collection": False,
+            "overwrite_existing_collection": True,
+            # keys of the collections are only taken over if they are in the template (fill_config_template)
+            "coll_tabelle_where": " ",
+            "coll_id": " ",
+            "coll_description": " ",
+            "coll_title": " ",
+            "coll_table": "images",
+            "coll_table_attributes": {
+                "geometry": "geom",
+                "srid": "srid",
+                "id": "image_id",
+                "item:start_datetime": "start_time",
+                "item:end_datetime": "end_time",
+                "item:sensor": "sensor",
+                "item:los_name": "los_name",
+                "folder": "folder",
+                "filename": "filename",
+                "watermark": "last_change"
+            },
+            "coll_bs_date_format": "%y/%m",
+            "coll_keywords": ["benchmark"],
+            "coll_providers": [{"id": "benchmark", "name": "Benchmark", "description": "Synthetic data", "roles": ["HOST"], "url": "http://127.0.0.1/"}],
+            "coll_license": "CC-BY-4.0",
+            "extensions": ["https://stac-extensions.github.io/projection/v1.0.0/schema.json"],
+            "assets": [{"id_format": "{id}_RGB", "url": "http://127.0.0.1/data/{folder}{filename}{filetype}", "filetype": ".tif",
+                        "title": "{id} RGB", "description": "Orthophoto", "roles": ["data"], "mediatype": "image/tiff; application=geotiff"}]
+        },
+        "collections": [{
+            "coll_tabelle_where": f"coll = {i}",
+            "coll_id": f"benchmark_{i}",
+            "coll_title": f"Benchmark {i}",
+            "coll_description": f"Synthetic collection {i}"
+        } for i in range(collections)]
+    }
+
+def get_parent_catalog_config(port, solr_writers = 1):
+    return {
+        "href": f"http://127.0.0.1:{port}/stac/",
+        "catalog_id": "benchmark",
+        "title": "Benchmark",
+        "catalog_description": "Synthetic catalog",
+        "solr": f"http://127.0.0.1:{port}/solr/stac",
+        "provider_website": "http://127.0.0.1/",
+        "provider_website_title": "Benchmark",
+        "solr_batch_size": 500,
+        "solr_batch_bytes": 10000000,
+        "solr_writers": solr_writers
+    }
+
+# geometries are WKB (hex) strings in SQLite - the PostGIS bbox functions used by pushdown are registered for every connection
+@event.listens_for(Engine, "connect")
+def register_sqlite_functions(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        for i, name in enumerate(["ST_XMin", "ST_YMin", "ST_XMax", "ST_YMax"]):
+            dbapi_connection.create_function(name, 1, lambda wkb, i=i: shapely.wkb.loads(wkb, hex=True).bounds[i])
+
+def create_sqlite_engine(db_url):
+    # timestamp columns are returned as datetime (like psycopg2 does)
+    return create_engine(db_url, connect_args={"detect_types": sqlite3.PARSE_DECLTYPES})
+
+### SOLR STAND-IN ###
+
+class SolrStandIn(BaseHTTPRequestHandler):
+    # Accepts solr updates (counts documents and bytes) and answers selects with no results,
+    # every other GET (STAC API) with 404, so all collections are created new
+    stats = {"requests": 0, "documents": 0, "deletes": 0, "commits": 0, "bytes": 0}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        params = parse_qs(urlparse(self.path).query)
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(body)
+            # pysolr sends added documents as a json array, deletes and commits as xml
+            if body.startswith(b"["):
+                self.stats["documents"] += len(json.loads(body))
+            self.stats["deletes"] += body.count(b"<delete")
+            if b"<commit" in body or params.get("commit") == ["true"]:
+                self.stats["commits"] += 1
+        self.send(200, {"responseHeader": {"status": 0}})
+
+    def do_GET(self):
+        path = urlparse(self.path)
+        if "/select" not in path.path:
+            return self.send(404, {})
+        cursor = parse_qs(path.query).get("cursorMark", ["*"])[0]
+        self.send(200, {"responseHeader": {"status": 0}, "response": {"numFound": 0, "start": 0, "docs": []}, "nextCursorMark": cursor})
+
+def start_solr_stand_in():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SolrStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+### STAGE TIMING ###
+
+class StageTimer(cdc.Metrics):
+    # Exclusive time per stage of the whole run (enter / exit of the script's metrics),
+    # the benchmark stages are timed by wrapping the functions of the script
+    def __init__(self):
+        super().__init__("Benchmark", None)
+        self.seconds = {s: 0.0 for s in stages}
+
+    def wrap(self, stage, f):
+        def timed(*args, **kwargs):
+            self.enter(stage)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self.exit()
+        return timed
+
+    def wrap_generator(self, stage, f):
+        # the time of a generator is spent in next(), not in the call
+        def timed(*args, **kwargs):
+            generator = f(*args, **kwargs)
+            while True:
+                self.enter(stage)
+                try:
+                    value = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    self.exit()
+                yield value
+        return timed
+
+    def wrap_factory(self, stage, f):
+        # for functions returning a function (row converter, item renderer): the returned function is timed
+        def timed(*args, **kwargs):
+            result = f(*args, **kwargs)
+            return self.wrap(stage, result) if result is not None else None
+        return timed
+
+def install_timers(timer):
+    # module functions are looked up at call time, so replacing them in the module times every call
+    # pystac, sqlalchemy, ... are imported by the script on first use, they are patched below
+    cdc.import_dependencies()
+    for stage, names in {
+            "select": ["select_from_db", "select_ids_from_db", "select_watermark"],
+            "convert": ["prepare_geometries", "add_projection_geometries"],
+            "item build": ["get_items", "link_item", "initialize_collection"],
+            "summarize": ["merge_extents", "merge_summaries", "get_extent_from_item_dicts", "select_collection_metadata"],
+            "serialize": ["get_item_document", "get_item_document_from_dict", "to_json_string"]}.items():
+        for name in names:
+            setattr(cdc, name, timer.wrap(stage, getattr(cdc, name)))
+    # every streamed read (one collection or a shared scan) goes through read_chunks, the conversion inside is timed on its own
+    cdc.read_chunks = timer.wrap_generator("select", cdc.read_chunks)
+    cdc.get_row_converter = timer.wrap_factory("convert", cdc.get_row_converter)
+    cdc.get_item_renderer = timer.wrap_factory("item build", cdc.get_item_renderer)
+    cdc.Summarizer.summarize = timer.wrap("summarize", cdc.Summarizer.summarize)
+    cdc.pystac.Extent.from_items = timer.wrap("summarize", cdc.pystac.Extent.from_items)
+    cdc.pystac.Collection.update_extent_from_items = timer.wrap("summarize", cdc.pystac.Collection.update_extent_from_items)
+    for name in ["add", "flush", "delete", "commit", "collection_finished"]:
+        setattr(cdc.SolrIndexer, name, timer.wrap("index", getattr(cdc.SolrIndexer, name)))
+    cdc.create_engine = create_sqlite_engine
+
+def print_results(results):
+    print()
+    print(f"rows: {results['rows']}  collections: {results['collections']}  vertices: {results['vertices']}  "
+          f"streaming: {results['streaming']}  pushdown: {results['pushdown']}")
+    print(f"{'stage':<12}{'seconds':>10}{'share':>8}")
+    for stage in stages:
+        share = results["stages"][stage] / results["seconds"] * 100 if results["seconds"] > 0 else 0
+        print(f"{stage:<12}{results['stages'][stage]:>10.3f}{share:>7.1f}%")
+    other = results["seconds"] - sum(results["stages"].values())
+    print(f"{'other':<12}{other:>10.3f}{other / results['seconds'] * 100:>7.1f}%")
+    print(f"{'total':<12}{results['seconds']:>10.3f}")
+    print(f"rows/sec: {results['rows_per_second']:.0f}")
+    print(f"solr: {results['solr']['documents']} documents, {results['solr']['bytes'] / 1024 / 1024:.1f} MB in {results['solr']['requests']} requests")
+    print("peak RSS: " + (f"{results['peak_rss_mb']:.0f} MB" if results["peak_rss_mb"] is not None else "n/a"))
+
+
+def main():
+    args = parse_arguments()
+    random.seed(args.seed)
+    work_directory = tempfile.mkdtemp(prefix="stac_benchmark_")
+    db_filepath = os.path.join(work_directory, "benchmark.sqlite")
+
+    print(f"Creating synthetic table ({args.rows} rows, {args.vertices} vertices) in {db_filepath}")
+    create_table(db_filepath, args.rows, args.collections, args.vertices)
+
+    server = start_solr_stand_in()
+    timer = StageTimer()
+    install_timers(timer)
+    cdc.configure_logging(os.path.join(work_directory, "benchmark.log"))
+    cdc.read_parent_catalog = False
+    cdc.configure(get_parent_catalog_config(server.server_address[1], args.solrWriters), "sqlite:///" + db_filepath,
+                  args.streaming, args.chunkSize, False, {}, args.pushdown)
+
+    start = time.perf_counter()
+    cdc.run([get_collection_config_file(args.collections)], os.path.join(work_directory, "benchmark.log"))
+    seconds = time.perf_counter() - start
+    server.shutdown()
+
+    stats = dict(SolrStandIn.stats)
+    # items + collections + catalog, run() only logs errors
+    if stats["documents"] != args.rows + args.collections + 1 or stats["commits"] == 0:
+        print(f"Benchmark run failed ({stats['documents']} documents indexed), see {os.path.join(work_directory, 'benchmark.log')}")
+        sys.exit(1)
+
+    results = {
+        "rows": args.rows,
+        "collections": args.collections,
+        "vertices": args.vertices,
+        "streaming": args.streaming,
+        "pushdown": args.pushdown,
+        "solr_writers": args.solrWriters,
+        "seconds": seconds,
+        "stages": timer.seconds,
+        "rows_per_second": args.rows / seconds,
+        "peak_rss_mb": cdc.get_peak_rss_mb(),
+        "solr": stats
+    }
+    print_results(results)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+    shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,127 +1,308 @@
 import json, argparse
-import os, requests
-import pystac
-import shapely
+import os, sys
+import glob
+import gzip
+import hashlib
+import re
 import decimal
-import shapely.wkb
-import pysolr
-from pyproj import CRS, Transformer
-from sqlalchemy import create_engine, text
-from shapely.geometry import Polygon
-from pystac.extensions.projection import ProjectionExtension
-from pystac.summaries import Summarizer
-from shapely.ops import transform
-from pystac.layout import CustomLayoutStrategy
-from datetime import datetime
-from cryptography.fernet import Fernet
-from distutils.util import strtobool
+import numbers
+import itertools
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache, wraps
+from contextlib import contextmanager, nullcontext
+from collections.abc import Mapping
+from types import SimpleNamespace
 
 import logging
+import time
+import cProfile
+import sqlite3
+import queue
+import threading
+
+# Heavy dependencies (pystac, shapely, pyproj, sqlalchemy, ...) are imported by import_dependencies(),
+# called by configure(), so importing this module (GUI, library use, worker start) only loads the standard library
+requests = HTTPAdapter = pystac = shapely = numpy = pysolr = None
+CRS = Transformer = create_engine = text = ProjectionExtension = transform = CustomLayoutStrategy = Fernet = None
+Summarizer = Summaries = SummaryStrategy = RangeSummary = datetime_to_str = str_to_datetime = None
+orjson = None
+# shapely 2 array functions (from_wkb, bounds, to_wkt, ...) work on whole chunks instead of single geometries
+vectorized_geometries = False
+# shapely type id -> GeoJSON type of the geometry types supported by get_geojson_geometries
+geojson_types = {0: "Point", 1: "LineString", 3: "Polygon", 4: "MultiPoint", 5: "MultiLineString", 6: "MultiPolygon"}
 
 read_parent_catalog = True
 generate_test_node = False
 use_key_for_decryption = False
+# streaming reads the db with a server-side cursor and indexes chunk by chunk
+streaming = False
+chunk_size = 5000
+# number of worker processes building and indexing collections in parallel (1 = sequential)
+workers = 1
+# incremental only selects rows changed since the last run (coll_table_attributes "watermark")
+incremental = False
+# pushdown computes extent and summaries of a collection with an aggregate query in the db instead of from the items
+pushdown = False
+# resume continues a failed run from the checkpoint journal (checkpoint_filepath in misc_config.json)
+resume = False
+# export writes the solr documents to NDJSON files in this directory instead of indexing them (see load_solr_ndjson.py)
+export_directory = None
+# number of the export run in the export directory (a resumed run writes its shards after those of the failed run)
+export_run = 1
 directory = os.path.dirname(os.path.realpath(__file__))
-config_directory = "\\config"
-
-# Misc Config read (logging_filepath) 
-with open(directory + config_directory + "\\misc_config.json") as f:
-    misc_config = json.load(f)
-
-logging.getLogger('pysolr').setLevel(logging.ERROR)
-# Configure the logger
-logging.basicConfig(
-    filename = misc_config["logging_filepath"], 
-    level = logging.INFO,
-    format = '{\"%(asctime)-s\": "%(levelname)-s %(message)s"}',
-    datefmt = '%d.%m.%Y %H:%M:%S',
-    filemode = 'w'
-)
-
-parser = argparse.ArgumentParser(description='Generate Catalog and add to solr index')
-parser.add_argument('--configs', '--names-list', nargs="*")
-parser.add_argument('--readParentCatalog', type=lambda x: bool(strtobool(x)), default=read_parent_catalog, help='Read parent catalog')
-parser.add_argument('--testMode', type=lambda x: bool(strtobool(x)), default=generate_test_node, help='TestMode')
-args = parser.parse_args()
-config_files_list = args.configs
-read_parent_catalog = args.readParentCatalog
-generate_test_node = args.testMode
-
-if not generate_test_node: collection_config_folder = "/collection_config_files"
-else: collection_config_folder = "/collection_config_files_test"
-
-
-with open(directory + config_directory +"\\auth_data\\conf.json") as f:
-    v_json_object = json.load(f)
-    
-if use_key_for_decryption:
-    with open(directory +"\\key.json") as f:
-        key = json.load(f)["key"]
-    cipher_suite = Fernet(key)
+config_directory = os.path.join(directory, "config")
 
-directory = os.path.dirname(os.path.realpath(__file__)) + config_directory  + collection_config_folder
+# limits sql statement (only the first ... rows get selected)
+# None creates the entire Catalog (takes several minutes)
+limit = None
 
+# Set by configure() - in the main process and in every worker process
+parent_catalog_config = None
+url = None
+solr_conn = None
+solr_indexer = None
+json_encoder = "json"
+http_session = None
+# coll_id -> True if the collection exists in the STAC API (or in solr), filled by check_collections_exist
+existing_collections = {}
+catalog = None
+items_indexed = set()
+# collections indexing only the envelopes of the item geometries (coll_geometry_index "envelope")
+envelope_collections = set()
+# coll_id -> item id -> wkt of the indexed geometry (prepare_geometries) of collections built without streaming,
+# used by index_items instead of computing the wkt from the item again
+item_wkts = {}
+# coll_id -> item properties (coll_table_attributes "item:*") indexed as typed fields (solr_property_fields)
+property_fields = {}
+# collections rebuilt in generation mode, their documents of older generations are deleted once the new ones are sent
+replaced_collections = set()
+# hash mode (solr_reindex "hash"): item documents carry a content hash, unchanged ones are not sent again
+content_hashes = False
+# collections rebuilt in hash mode: uniqueid -> content hash of their item documents in solr. Ids are removed
+# when the item is generated again, the remaining documents are deleted (see remove_missing_documents)
+indexed_hashes = {}
+# last watermark per collection id, stored in the incremental state file
+incremental_state = {}
+# sqlite checkpoint journal of the run (see configure_checkpoints), None = no checkpoints
+checkpoint_filepath = None
+# progress lines on stdout and cooperative cancellation (see configure_progress), used by the GUI
+progress_output = False
+cancel_filepath = None
+# rows of the collections (only counted with progress_output)
+collection_totals = {}
+
+# Instrumentation (see configure_metrics): JSON record per collection in the metrics file, cProfile output with --profile
+metrics_logger = logging.getLogger("create_dynamic_catalog.metrics")
+# records only go to the metrics file (configure_metrics), never to the log of the application
+metrics_logger.propagate = False
+metrics_logger.addHandler(logging.NullHandler())
+profile_directory = None
+current_metrics = None
+run_metrics = {}
+finished_metrics = []
+
+
+def import_dependencies():
+    global requests, HTTPAdapter, pystac, shapely, numpy, pysolr, CRS, Transformer, create_engine, text, ProjectionExtension, transform
+    global CustomLayoutStrategy, Fernet, Summarizer, Summaries, SummaryStrategy, RangeSummary, datetime_to_str, str_to_datetime
+    global orjson, vectorized_geometries
+    if pystac is not None:
+        return
+    import requests
+    import pystac
+    import shapely
+    import numpy
+    import shapely.wkb
+    import shapely.geometry
+    import pysolr
+    from pyproj import CRS, Transformer
+    from sqlalchemy import create_engine, text
+    from pystac.extensions.projection import ProjectionExtension
+    from pystac.summaries import Summarizer, Summaries, SummaryStrategy, RangeSummary
+    from shapely.ops import transform
+    from pystac.layout import CustomLayoutStrategy
+    from cryptography.fernet import Fernet
+    from requests.adapters import HTTPAdapter
+    from pystac.utils import datetime_to_str, str_to_datetime
+    # optional, faster json encoder for the solr json_string field (solr_json_encoder: "orjson")
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+    vectorized_geometries = hasattr(shapely, "from_wkb")
+
+def strtobool(value):
+    # same as distutils.util.strtobool (distutils takes long to import and is removed in python 3.12)
+    value = value.lower()
+    if value in ("y", "yes", "t", "true", "on", "1"):
+        return 1
+    if value in ("n", "no", "f", "false", "off", "0"):
+        return 0
+    raise ValueError(f"invalid truth value {value!r}")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Generate Catalog and add to solr index')
+    parser.add_argument('--configs', '--names-list', nargs="*")
+    parser.add_argument('--readParentCatalog', type=lambda x: bool(strtobool(x)), default=read_parent_catalog, help='Read parent catalog')
+    parser.add_argument('--testMode', type=lambda x: bool(strtobool(x)), default=generate_test_node, help='TestMode')
+    parser.add_argument('--streaming', type=lambda x: bool(strtobool(x)), default=streaming, help='Stream rows from db to solr in chunks (constant memory)')
+    parser.add_argument('--chunkSize', type=int, default=chunk_size, help='Number of rows per chunk in streaming mode')
+    parser.add_argument('--workers', type=int, default=workers, help='Number of worker processes building collections in parallel')
+    parser.add_argument('--incremental', type=lambda x: bool(strtobool(x)), default=incremental, help='Only index rows changed since the last run')
+    parser.add_argument('--pushdown', type=lambda x: bool(strtobool(x)), default=pushdown, help='Compute extent and summaries of the collections in the db')
+    parser.add_argument('--resume', type=lambda x: bool(strtobool(x)), default=resume, help='Continue a failed run from the checkpoint journal')
+    parser.add_argument('--export', default=None, help='Write the solr documents to NDJSON files in this directory instead of indexing them')
+    parser.add_argument('--progress', type=lambda x: bool(strtobool(x)), default=False, help='Print machine readable progress lines (PROGRESS {...})')
+    parser.add_argument('--cancelFile', default=None, help='The run stops at the next batch once this file exists')
+    parser.add_argument('--profile', type=lambda x: bool(strtobool(x)), default=False, help='Write cProfile output for every collection')
+    return parser.parse_args()
+
+def configure_logging(logging_filepath, filemode = 'w'):
+    logging.getLogger('pysolr').setLevel(logging.ERROR)
+    # Configure the logger
+    logging.basicConfig(
+        filename = logging_filepath, 
+        level = logging.INFO,
+        format = '{\"%(asctime)-s\": "%(levelname)-s %(message)s"}',
+        datefmt = '%d.%m.%Y %H:%M:%S',
+        filemode = filemode
+    )
 
-def decrypt_json(data):
+def configure_metrics(metrics_filepath, profile_dir = None, filemode = 'w'):
+    # one JSON record per line, independent of the log format
+    global profile_directory
+    metrics_logger.handlers.clear()
+    metrics_logger.propagate = False
+    metrics_logger.setLevel(logging.INFO)
+    if metrics_filepath is not None:
+        if filemode == 'w':
+            open(metrics_filepath, 'w').close()
+        # always appended, the worker processes write to the same file
+        handler = logging.FileHandler(metrics_filepath, mode = 'a')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        metrics_logger.addHandler(handler)
+    profile_directory = profile_dir
+    if profile_directory is not None:
+        os.makedirs(profile_directory, exist_ok = True)
+
+def decrypt_json(data, cipher_suite):
     for key, value in data.items():
         if isinstance(value, dict):
-            decrypt_json(value)
+            decrypt_json(value, cipher_suite)
         else:
             data[key] = cipher_suite.decrypt(value).decode('utf-8')
 
-if use_key_for_decryption:
-    decrypt_json(v_json_object)
-db_config = v_json_object.copy()["db"]
-
-# limits sql statement (only the first ... rows get selected)
-# None creates the entire Catalog (takes several minutes)
-limit = None
-
-
-
-if config_files_list == None:
-    raise Exception("No configs provided")
-
-# Read JSON config files
-config_files = []
-
-for cfp in config_files_list:
-    with open(cfp, mode="r", encoding="utf-8") as file:
-        c = json.load(file)
-        c["config_file_name"] = cfp.split('/')[-1]
-        config_files.append(c)
-
-#catalog config
-#config files of static catalogs that shall be indexed 
-parent_stac_config_filepath = directory +"/empty_parent_catalog.json"
-with open(parent_stac_config_filepath, mode="r", encoding="utf-8") as file:
-    parent_catalog_config = json.load(file)
-
-solr_conn = pysolr.Solr(parent_catalog_config["solr"])
-
-# Database Connection String
-url = "{dbtype}://{u}:{p}@{h}:{port}/{db}".format(dbtype=db_config["dbtype"],
-                                                  u=db_config["u"],
-                                                  p=db_config["p"],
-                                                  h=db_config["host"],
-                                                  port=db_config["port"],
-                                                  db=db_config["name"])
+def read_db_url():
+    with open(os.path.join(config_directory, "auth_data", "conf.json")) as f:
+        v_json_object = json.load(f)
+
+    if use_key_for_decryption:
+        import_dependencies()
+        with open(os.path.join(directory, "key.json")) as f:
+            key = json.load(f)["key"]
+        decrypt_json(v_json_object, Fernet(key))
+    db_config = v_json_object["db"]
+
+    # Database Connection String
+    return "{dbtype}://{u}:{p}@{h}:{port}/{db}".format(dbtype=db_config["dbtype"],
+                                                      u=db_config["u"],
+                                                      p=db_config["p"],
+                                                      h=db_config["host"],
+                                                      port=db_config["port"],
+                                                      db=db_config["name"])
+
+def read_config_files(config_files_list):
+    # Read JSON config files
+    config_files = []
+    for cfp in config_files_list:
+        with open(cfp, mode="r", encoding="utf-8") as file:
+            c = json.load(file)
+            c["config_file_name"] = cfp.split('/')[-1]
+            config_files.append(c)
+    return config_files
+
+def read_parent_catalog_config(test_mode = None):
+    #catalog config
+    #config files of static catalogs that shall be indexed 
+    test_mode = generate_test_node if test_mode is None else test_mode
+    collection_config_folder = "collection_config_files" if not test_mode else "collection_config_files_test"
+    with open(os.path.join(config_directory, collection_config_folder, "empty_parent_catalog.json"), mode="r", encoding="utf-8") as file:
+        return json.load(file)
+
+def configure(catalog_config, db_url, stream = False, stream_chunk_size = 5000, incremental_update = False, state = None, pushdown_metadata = False, export_dir = None):
+    global parent_catalog_config, url, streaming, chunk_size, incremental, incremental_state, pushdown, export_directory, solr_conn, solr_indexer, json_encoder, content_hashes
+    import_dependencies()
+    parent_catalog_config = catalog_config
+    url = db_url
+    streaming = stream
+    chunk_size = stream_chunk_size
+    incremental = incremental_update
+    pushdown = pushdown_metadata
+    export_directory = export_dir
+    incremental_state = state if state is not None else {}
+    if solr_indexer is not None:
+        # writer threads of the indexer this one replaces (e.g. a second CatalogGenerator)
+        solr_indexer.close()
+    solr_conn = pysolr.Solr(parent_catalog_config["solr"])
+    writers = parent_catalog_config.get("solr_writers", 1)
+    # pooled connections for the writer threads of the indexer (keep-alive)
+    solr_conn.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = max(writers, 1))
+    solr_conn.session.mount("http://", adapter)
+    solr_conn.session.mount("https://", adapter)
+    solr_indexer = SolrIndexer(solr_conn,
+                               batch_size = parent_catalog_config.get("solr_batch_size", 500),
+                               batch_bytes = parent_catalog_config.get("solr_batch_bytes", 10000000),
+                               commit_within = parent_catalog_config.get("solr_commit_within"),
+                               soft_commit = parent_catalog_config.get("solr_soft_commit", False),
+                               optimize = parent_catalog_config.get("solr_optimize", False),
+                               writers = writers,
+                               max_batch_size = parent_catalog_config.get("solr_max_batch_size", 5000),
+                               target_latency = parent_catalog_config.get("solr_target_latency", 2.0),
+                               retries = parent_catalog_config.get("solr_retries", 3),
+                               retry_backoff = parent_catalog_config.get("solr_retry_backoff", 1.0))
+    if export_directory is not None:
+        # solr_conn is still used for reading (incremental mode, collection_existence_check "solr")
+        solr_indexer = NdjsonExporter(export_directory,
+                                      shard_size = parent_catalog_config.get("export_shard_documents", 100000),
+                                      compress = parent_catalog_config.get("export_compress", True))
+    json_encoder = parent_catalog_config.get("solr_json_encoder", "json")
+    content_hashes = parent_catalog_config.get("solr_reindex", "delete") == "hash"
+    if json_encoder == "orjson" and orjson is None:
+        logging.warning("orjson is not installed - json_string is encoded with json")
+        json_encoder = "json"
 
 
 ### UTIL FUNCTIONS ###
 # Reprojects wgs84 to data crs
+# Building a Transformer is expensive (CRS lookup in the proj database), so one is kept per (source, target) EPSG pair
+@lru_cache(maxsize=64)
+def get_transformer(source_epsg: str, target_epsg: str):
+    return Transformer.from_crs(
+        CRS('EPSG:' + source_epsg), CRS('EPSG:' + target_epsg), always_xy=True)
+
 def reproject(geometry: any, epsg: str):
-    wgs84 = CRS('EPSG:4326')
-    goal_crs = CRS('EPSG:' + epsg)
-    transformer = Transformer.from_crs(
-        wgs84, goal_crs, always_xy=True).transform
+    transformer = get_transformer('4326', str(epsg)).transform
     return transform(transformer, geometry)
 
-def add_epsg(item, epsg: int, shape: str = None):
+def add_epsg(item, epsg: int, shape: dict = None, bbox: list = None):
     item_projection = ProjectionExtension.ext(item, add_if_missing=True)
     item_projection.epsg = int(epsg)
+    # proj:geometry / proj:bbox - the item geometry in its native crs (see add_projection_geometries)
+    if shape is not None:
+        item_projection.geometry = shape
+    if bbox is not None:
+        item_projection.bbox = list(bbox)
     return item
 
+# json_string of the solr documents, minified (no spaces after separators, non-ascii characters not escaped)
+# like the output of orjson, which is faster
+def to_json_string(d):
+    if json_encoder == "orjson":
+        return orjson.dumps(d).decode("utf-8")
+    return json.dumps(d, separators = (",", ":"), ensure_ascii = False)
+
 def key_exists(element, key):
     if key in list(element.keys()):
         return True
@@ -133,13 +314,6 @@ def key_exists(element, key):
             continue
     return False
 
-def is_valid_json(s):
-    try:
-        json.loads(s)
-        return True
-    except ValueError:
-        return False
-
    
 def get_date_from_id(input_str):
     year = int(input_str[:4])
@@ -148,65 +322,462 @@ def get_date_from_id(input_str):
     
     return datetime(year, month, day)
 
+def merge_extents(extent, other):
+    # Union of two extents (same result as update_extent_from_items over the items of both)
+    if extent is None:
+        return other
+    a = extent.spatial.bboxes[0]
+    b = other.spatial.bboxes[0]
+    bbox = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+    starts = [i[0] for i in [extent.temporal.intervals[0], other.temporal.intervals[0]] if i[0] is not None]
+    ends = [i[1] for i in [extent.temporal.intervals[0], other.temporal.intervals[0]] if i[1] is not None]
+    return pystac.Extent(
+        spatial = pystac.SpatialExtent([bbox]),
+        temporal = pystac.TemporalExtent([[min(starts) if starts else None, max(ends) if ends else None]])
+    )
+
+def merge_summaries(summaries, other):
+    # Adds the summaries of a chunk of items to the summaries of the collection
+    for key, values in other.lists.items():
+        current = summaries.get_list(key) or []
+        for v in values:
+            if v not in current:
+                current.append(v)
+        summaries.add(key, current)
+    for key, value_range in other.ranges.items():
+        current = summaries.get_range(key)
+        if current is None:
+            summaries.add(key, value_range)
+        else:
+            current.update_with_value(value_range.minimum)
+            current.update_with_value(value_range.maximum)
+    for key, schema in other.schemas.items():
+        if summaries.get_schema(key) is None:
+            summaries.add(key, schema)
+    return summaries
+
+### INSTRUMENTATION ###
+
+class Metrics:
+    # Time per stage, counters and peak memory of one collection (or the catalog).
+    # Stage times are exclusive: a stage started inside another one pauses the outer stage
+    def __init__(self, stac_type, id):
+        self.stac_type = stac_type
+        self.id = id
+        self.seconds = {}
+        self.counters = {}
+        self.wall_seconds = 0.0
+        self.stack = []
+        self.profiler = cProfile.Profile() if profile_directory is not None else None
+
+    def enter(self, stage_name):
+        now = time.perf_counter()
+        if len(self.stack) > 0:
+            outer = self.stack[-1]
+            self.seconds[outer[0]] = self.seconds.get(outer[0], 0.0) + now - outer[1]
+        self.stack.append([stage_name, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        stage_name, start = self.stack.pop()
+        self.seconds[stage_name] = self.seconds.get(stage_name, 0.0) + now - start
+        if len(self.stack) > 0:
+            self.stack[-1][1] = now
+
+    def count(self, counter, n = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def to_dict(self):
+        rows = self.counters.get("rows", 0)
+        return {
+            "type": self.stac_type,
+            "id": self.id,
+            "seconds": round(self.wall_seconds, 3),
+            "stages": {k: round(v, 3) for k, v in self.seconds.items()},
+            "counters": self.counters,
+            "rows_per_second": round(rows / self.wall_seconds, 1) if rows > 0 and self.wall_seconds > 0 else None,
+            "peak_rss_mb": get_peak_rss_mb()
+        }
+
+def get_peak_rss_mb():
+    # peak resident set size of the process so far (None if it can not be read on this platform)
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024, 1)
+    except ImportError:
+        pass
+    if sys.platform != "win32":
+        return None
+    # windows: peak working set of the process (psapi GetProcessMemoryInfo)
+    import ctypes
+    from ctypes import wintypes
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    get_process_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+    get_process_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+    get_process_memory_info.restype = wintypes.BOOL
+    get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+    get_current_process.restype = wintypes.HANDLE
+    if not get_process_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+        return None
+    return round(counters.PeakWorkingSetSize / 1024 / 1024, 1)
+
+@contextmanager
+def stage(stage_name):
+    m = current_metrics
+    if m is None:
+        yield
+        return
+    m.enter(stage_name)
+    try:
+        yield
+    finally:
+        m.exit()
+
+def timed_stage(stage_name):
+    # decorator: the whole function is timed as stage_name
+    def decorator(f):
+        @wraps(f)
+        def timed(*args, **kwargs):
+            with stage(stage_name):
+                return f(*args, **kwargs)
+        return timed
+    return decorator
+
+def count(counter, n = 1):
+    if current_metrics is not None:
+        current_metrics.count(counter, n)
+
+@contextmanager
+def measure(stac_type, id):
+    # Activates the metrics of a collection / the catalog - a collection is built and indexed at different times
+    global current_metrics
+    m = run_metrics.setdefault((stac_type, id), Metrics(stac_type, id))
+    previous = current_metrics
+    current_metrics = m
+    start = time.perf_counter()
+    if m.profiler is not None:
+        m.profiler.enable()
+    try:
+        yield m
+    finally:
+        if m.profiler is not None:
+            m.profiler.disable()
+        m.wall_seconds += time.perf_counter() - start
+        current_metrics = previous
+
+def finish_metrics(stac_type, id):
+    m = run_metrics.pop((stac_type, id), None)
+    if m is None:
+        return None
+    record = m.to_dict()
+    metrics_logger.info(json.dumps(record))
+    if m.profiler is not None:
+        m.profiler.dump_stats(os.path.join(profile_directory, f"{stac_type.lower()}_{id}.prof"))
+    finished_metrics.append(record)
+    return record
+
+class RunCancelled(Exception):
+    pass
+
+def configure_progress(progress = False, cancel_file = None):
+    global progress_output, cancel_filepath
+    progress_output = progress
+    cancel_filepath = cancel_file
+
+def report_progress(collection_id):
+    # Called at batch boundaries: stops the run if the cancel file exists (the checkpoint journal is kept,
+    # so a cancelled run can be resumed) and prints the counters of the collection as a progress line
+    if cancel_filepath is not None and os.path.exists(cancel_filepath):
+        raise RunCancelled(f"Run cancelled ({collection_id})")
+    if progress_output and current_metrics is not None:
+        print("PROGRESS " + json.dumps({
+            "id": collection_id,
+            "rows": current_metrics.counters.get("rows", 0),
+            "documents": current_metrics.counters.get("documents", 0),
+            "total": collection_totals.get(collection_id)
+        }), flush = True)
+
+def write_prometheus_textfile(filepath, records, success, seconds):
+    # Textfile for the node exporter (textfile collector), replaced at the end of every run
+    def labels(r, **extra):
+        return "{" + ",".join(f'{k}="{v}"' for k, v in dict(type=r["type"], id=r["id"], **extra).items()) + "}"
+    lines = [
+        "# TYPE stac_run_success gauge", f"stac_run_success {1 if success else 0}",
+        "# TYPE stac_run_seconds gauge", f"stac_run_seconds {seconds:.3f}",
+        "# TYPE stac_run_timestamp_seconds gauge", f"stac_run_timestamp_seconds {time.time():.0f}",
+        "# TYPE stac_seconds gauge"] + [f"stac_seconds{labels(r)} {r['seconds']}" for r in records] + [
+        "# TYPE stac_stage_seconds gauge"] + [f"stac_stage_seconds{labels(r, stage=k)} {v}" for r in records for k, v in r["stages"].items()] + [
+        "# TYPE stac_count gauge"] + [f"stac_count{labels(r, counter=k)} {v}" for r in records for k, v in r["counters"].items()] + [
+        "# TYPE stac_peak_rss_megabytes gauge"] + [f"stac_peak_rss_megabytes{labels(r)} {r['peak_rss_mb']}" for r in records if r["peak_rss_mb"] is not None]
+    with open(filepath + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(filepath + ".tmp", filepath)
+
 ### MAIN FUNCTIONS ###
 
+# Columns added to every row by prepare_geometries / add_projection_geometries
+derived_fields = ["geometry_bbox", "geometry_geojson", "geometry_wkt", "proj_geometry", "proj_bbox"]
+
+class Record(Mapping):
+    # Compact db row: a list of values and a key -> index dict shared by all rows of a collection
+    __slots__ = ("fields", "values")
+
+    def __init__(self, fields, values):
+        self.fields = fields
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[self.fields[key]]
+
+    def __setitem__(self, key, value):
+        self.values[self.fields[key]] = value
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+
+def decode_json(value):
+    if "{" in value:
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+# Converter of one column for one python type of its values (json, date, Decimal, datetime, WKB are told apart once)
+def compile_converter(key, value, config, parse_date):
+    if value is None:
+        return lambda v: v
+    if isinstance(value, str):
+        if key == "date":
+            now = datetime.now()
+            def convert_date(v):
+                date_object = parse_date(v)
+                if date_object > now:
+                    logging.error(f"FUTURE date ({date_object}) - change db data!")
+                return date_object
+            return convert_date
+        if key == "geometry":
+            # WKB is decoded for the whole chunk in prepare_geometries
+            return lambda v: v
+        return decode_json
+    if key.endswith("datetime"):
+        return datetime.isoformat
+    if key == "geometry":
+        return lambda v: v
+    if isinstance(value, decimal.Decimal):
+        return float
+    if key == "item:mission":
+        return str
+    return lambda v: v
+
+# Returns a function converting one db row into a Record (key defined in coll_table_attributes -> value).
+# The converter of a column is compiled for the type of its first value and reused for all rows
+def get_row_converter(keys, config):
+    keys = list(keys)
+    fields = {k: i for i, k in enumerate(keys + derived_fields)}
+    padding = [None] * len(derived_fields)
+    date_format = config.get("coll_bs_date_format")
+    # formats like %y/%m only have a few distinct values
+    parse_date = lru_cache(maxsize=4096)(lambda v: datetime.strptime(v, date_format))
+    converters = [{} for k in keys]
+
+    def convert(e):
+        values = []
+        for i, v in enumerate(e):
+            c = converters[i].get(v.__class__)
+            if c is None:
+                c = converters[i][v.__class__] = compile_converter(keys[i], v, config, parse_date)
+            values.append(c(v))
+        values.extend(padding)
+        return Record(fields, values)
+    return convert
+
+
+# GeoJSON geometries of a shapely 2 geometry array: the coordinates of all geometries of one type
+# (and dimension) are read with one to_ragged_array call and split along its offsets into rings, parts and geometries
+def get_geojson_geometries(geoms):
+    result = [None] * len(geoms)
+    groups = shapely.get_type_id(geoms) * 2 + shapely.has_z(geoms)
+    for group in set(groups.tolist()):
+        type_id, has_z = group // 2, bool(group % 2)
+        indices = (groups == group).nonzero()[0]
+        if type_id not in geojson_types:
+            # e.g. GeometryCollection, not supported by to_ragged_array
+            for i in indices.tolist():
+                result[i] = shapely.geometry.mapping(geoms[i])
+            continue
+        geometry_type, coords, offsets = shapely.to_ragged_array(geoms[indices], include_z=has_z)
+        parts = [tuple(c) for c in coords.tolist()]
+        for o in offsets:
+            o = o.tolist()
+            parts = [tuple(parts[o[k]:o[k + 1]]) for k in range(len(o) - 1)]
+        for i, coordinates in zip(indices.tolist(), parts):
+            result[i] = {"type": geojson_types[type_id], "coordinates": coordinates}
+    return result
+
+# Applies f (coordinate array -> coordinate array) to a shapely 2 geometry array,
+# 2D and 3D geometries separately, so 2D geometries do not get a NaN z
+def transform_geometries(geoms, f):
+    has_z = shapely.has_z(geoms)
+    for z in set(has_z.tolist()):
+        geoms[has_z == z] = shapely.transform(geoms[has_z == z], f, include_z=z)
+    return geoms
+
+# Decodes the WKB geometries of a chunk of rows and precomputes everything the item and
+# solr document builders need: geometry, bbox (bounds), GeoJSON and WKT (for the solr bbox field).
+# The geometries are simplified (coll_geometry_simplify) and their coordinates rounded (coll_geometry_precision) first,
+# with coll_geometry_index "envelope" only the envelope is indexed
+def prepare_geometries(rows, config):
+    if len(rows) == 0:
+        return rows
+    tolerance = config.get("coll_geometry_simplify")
+    precision = config.get("coll_geometry_precision")
+    envelope = config.get("coll_geometry_index", "geometry") == "envelope"
+    if vectorized_geometries:
+        geoms = shapely.from_wkb([r["geometry"] for r in rows])
+        if tolerance:
+            geoms = shapely.simplify(geoms, tolerance, preserve_topology=True)
+        if precision is not None:
+            geoms = transform_geometries(geoms, lambda c: numpy.round(c, precision))
+        bounds = [tuple(b) for b in shapely.bounds(geoms).tolist()]
+        geojson = get_geojson_geometries(geoms)
+        wkts = shapely.to_wkt(shapely.envelope(geoms) if envelope else geoms, rounding_precision=-1).tolist()
+    else:
+        geoms = [shapely.wkb.loads(r["geometry"], hex=True) for r in rows]
+        if tolerance:
+            geoms = [g.simplify(tolerance, preserve_topology=True) for g in geoms]
+        if precision is not None:
+            geoms = [transform(lambda *c: tuple(numpy.round(c, precision)), g) for g in geoms]
+        bounds = [g.bounds for g in geoms]
+        geojson = [shapely.geometry.mapping(g) for g in geoms]
+        wkts = [g.envelope.wkt if envelope else g.wkt for g in geoms]
+    for r, g, b, j, w in zip(rows, geoms, bounds, geojson, wkts):
+        r["geometry"] = g
+        r["geometry_bbox"] = b
+        r["geometry_geojson"] = j
+        r["geometry_wkt"] = w
+    return rows
+
+
+# Transforms the (WGS84) geometries of a chunk back into the crs of their srid column for the projection
+# extension (proj:geometry, proj:bbox). Rows are grouped by srid, so every group needs one cached transformer
+# and - with shapely 2 - one transform call for all of its coordinates
+def add_projection_geometries(rows, config):
+    if len(rows) == 0 or not config.get("coll_projection_geometry", True):
+        return rows
+    groups = {}
+    for r in rows:
+        if r.get("srid") is not None:
+            groups.setdefault(str(r["srid"]), []).append(r)
+    for epsg, group in groups.items():
+        if epsg == "4326":
+            for r in group:
+                r["proj_geometry"] = r["geometry_geojson"]
+                r["proj_bbox"] = r["geometry_bbox"]
+            continue
+        transformer = get_transformer('4326', epsg)
+        if vectorized_geometries:
+            geoms = numpy.empty(len(group), dtype=object)
+            geoms[:] = [r["geometry"] for r in group]
+            geoms = transform_geometries(geoms, lambda c: numpy.column_stack(transformer.transform(*c.T)))
+            bounds = shapely.bounds(geoms).tolist()
+            for r, b, j in zip(group, bounds, get_geojson_geometries(geoms)):
+                r["proj_geometry"] = j
+                r["proj_bbox"] = tuple(b)
+        else:
+            for r in group:
+                g = transform(transformer.transform, r["geometry"])
+                r["proj_geometry"] = shapely.geometry.mapping(g)
+                r["proj_bbox"] = g.bounds
+    return rows
+
+
+@timed_stage("convert")
 def convert_dataframe(df, attr, config):
     # Filling the object to be returned, doing conversions etc.
-    a = attr.copy()
+    convert_row = get_row_converter(attr.keys(), config)
     attributes = {}
     cnt = 1
-    for e in list(df):
-        for i in range(len(a.keys())):
-            key = list(a.keys())[i]
-            if key == "date" and isinstance(e[i], str):
-                date_object = datetime.strptime(e[i], config["coll_bs_date_format"])
-                if date_object > datetime.now():
-                    logging.error(f"FUTURE date ({date_object}) - change db data!")
-                a[key] = datetime.strptime(e[i], config["coll_bs_date_format"])
-            elif "{" in str(e[i]) and is_valid_json(e[i]):
-                a[key] = json.loads(e[i])
-            elif key.endswith("datetime"):
-                a[key] = datetime.isoformat(e[i])
-            elif key == "geometry":
-                a[key] = shapely.wkb.loads(e[i], hex=True)
-            elif isinstance(e[i], decimal.Decimal):
-                a[key] = float(e[i])
-            elif key == "item:mission":
-                a[key] = "{mission}".format(
-                    mission=str(e[i]))
-            else:
-                a[key] = e[i]
-        
-        attributes[a["id"]] = a.copy()
+    for e in df:
+        a = convert_row(e)
+        attributes[a["id"]] = a
         if cnt % 1000 == 0:
             print(str(cnt) + " finished reading from db - " + str(a["id"]))
+            report_progress(config["coll_id"])
         cnt = cnt + 1
+    add_projection_geometries(prepare_geometries(list(attributes.values()), config), config)
+    count("rows", len(attributes))
     return attributes
 
 
+def get_where_clause(config):
+    attr = config["coll_table_attributes"]
+    # date or start_datetime must not be null!
+    date_attribute = attr["date"] if "date" in attr.keys() else attr["item:start_datetime"]
+    return "{date} IS NOT NULL and {where}".format(date = date_attribute, where = config["coll_tabelle_where"])
+
+
+def get_select_statement(config, changed_since = None, after = None, ordered = False, until = None):
+    attr = config["coll_table_attributes"]
+    # Selects row from DB with attributes defined in the config (coll_table_attributes)
+    sql = "SELECT {attr} FROM {table} WHERE {where};".format(  # order by image_id
+        attr=",".join(attr.values()),
+        table=config["coll_table"],
+        where=get_where_clause(config),
+    )
+
+    # Incremental update: only rows changed after the last run (bound as :watermark)
+    if changed_since is not None:
+        sql = sql.replace(";", " and {watermark} > :watermark;".format(watermark=attr["watermark"]))
+
+    # Resumed collection: only rows after the id of the last checkpoint (bound as :after), in the order of the ids
+    # Partition: keyset range of ids after :after up to :until
+    if after is not None:
+        sql = sql.replace(";", " and {id} > :after;".format(id=attr["id"]))
+    if until is not None:
+        sql = sql.replace(";", " and {id} <= :until;".format(id=attr["id"]))
+    if ordered:
+        sql = sql.replace(";", " ORDER BY {id};".format(id=attr["id"]))
+
+    # If a limit is defined, it is appended to the select statement
+    if limit is not None:
+        sql = sql.replace(";", " LIMIT {limit};".format(limit=str(limit)))
+    return sql
+
+
+@timed_stage("select")
 def select_from_db(config):
     attr = config["coll_table_attributes"]
     result = {}
+    if get_partition_count(config) > 1:
+        result = {r["id"]: r for chunk in stream_partitions_from_db(config) for r in chunk}
+        if len(result) == 0:
+            print("No data found in db - check table and / or select statement")
+            raise Exception("No data in db")
+        return result
+
     # Connect to the database
     db_connection = create_engine(url)
 
-    # date or start_datetime must not be null!
-    date_attribute = attr["date"] if "date" in attr.keys() else attr["item:start_datetime"]
     with db_connection.begin() as conn:
-        # Selects row from DB with attributes defined in the config (coll_table_attributes)
-        sql = "SELECT {attr} FROM {table} WHERE {date} IS NOT NULL and {where};".format(  # order by image_id
-            attr=",".join(attr.values()),
-            table=config["coll_table"],
-            date= date_attribute,
-            where=config["coll_tabelle_where"],
-        )
-
-        # If a limit is defined, it is appended to the select statement
-        if limit is not None:
-            sql = sql.replace(";", " LIMIT {limit};".format(limit=str(limit)))
         # Execution of the select
-        df = conn.execute(text(sql))
-        result = convert_dataframe(df, attr, config).copy()
+        df = conn.execute(text(get_select_statement(config)))
+        result = convert_dataframe(df, attr, config)
 
     if len(result) == 0:
         print("No data found in db - check table and / or select statement")
@@ -214,6 +785,318 @@ def select_from_db(config):
     return result
 
 
+def read_chunks(conn, statement, params, convert_row, config, measured = True):
+    # A server-side cursor fetches chunk_size rows of the statement at a time, every chunk is converted
+    # (convert_row: selected row -> record) and yielded as a list of records, so memory depends on chunk_size only.
+    # measured = False in threads (the metrics are not thread-safe)
+    timed = stage if measured else lambda stage_name: nullcontext()
+    df = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(text(statement), params)
+    partitions = df.partitions(chunk_size)
+    while True:
+        with timed("select"):
+            rows = next(partitions, None)
+        if rows is None:
+            return
+        with timed("convert"):
+            chunk = add_projection_geometries(prepare_geometries([convert_row(e) for e in rows], config), config)
+        yield chunk
+
+def stream_from_db(config, changed_since = None, after = None, ordered = False):
+    # Generator variant of select_from_db, the rows are read and yielded in chunks (see read_chunks)
+    if get_partition_count(config) > 1 and after is None and not ordered:
+        yield from stream_partitions_from_db(config, changed_since)
+        return
+    convert_row = get_row_converter(config["coll_table_attributes"].keys(), config)
+    db_connection = create_engine(url)
+
+    with db_connection.connect() as conn:
+        params = {"watermark": changed_since} if changed_since is not None else {}
+        if after is not None:
+            params["after"] = after
+        cnt = 0
+        for chunk in read_chunks(conn, get_select_statement(config, changed_since, after, ordered), params, convert_row, config):
+            count("rows", len(chunk))
+            cnt = cnt + len(chunk)
+            print(str(cnt) + " finished reading from db - " + str(chunk[-1]["id"]))
+            yield chunk
+    db_connection.dispose()
+
+
+# SHARED TABLE SCANS
+
+# Collections that only differ in coll_tabelle_where are read with one query (see get_shared_scan_key):
+# the table is scanned once for all of them instead of once per collection
+def get_shared_scan_key(collection_config):
+    # None = the collection is read on its own (not streamed, partitioned, limited, updated incrementally or resumed)
+    if not streaming or not parent_catalog_config.get("shared_table_scan", True) or limit is not None:
+        return None
+    if get_partition_count(collection_config) > 1:
+        return None
+    if incremental and "watermark" in collection_config["coll_table_attributes"] and collection_config["coll_id"] in incremental_state:
+        return None
+    if read_checkpoint("collection_" + collection_config["coll_id"]) is not None:
+        return None
+    # everything the query and the conversion of the rows depend on
+    return json.dumps([collection_config.get(k) for k in ["coll_table", "coll_table_attributes", "coll_bs_date_format", "coll_geometry_simplify",
+                                                        "coll_geometry_precision", "coll_geometry_index", "coll_projection_geometry"]], sort_keys = True)
+
+def group_shared_scans(collection_configs):
+    # collections with the same shared scan key form a group (also if other collections are configured between them),
+    # the groups are in the order of their first collection. The caller adds the collections to the catalog in config order.
+    groups = []
+    shared_groups = {}
+    for collection_config in collection_configs:
+        key = get_shared_scan_key(collection_config)
+        if key is None:
+            groups.append([collection_config])
+        elif key in shared_groups:
+            shared_groups[key].append(collection_config)
+        else:
+            shared_groups[key] = [collection_config]
+            groups.append(shared_groups[key])
+    return groups
+
+def get_shared_where_clause(collection_configs):
+    return " OR ".join("({where})".format(where=get_where_clause(c)) for c in collection_configs)
+
+def get_shared_select_statement(collection_configs):
+    # every where clause becomes a tag column: CASE ... THEN 1 ELSE 0, so a row can belong to several collections
+    attr = collection_configs[0]["coll_table_attributes"]
+    return "SELECT {attr},{tags} FROM {table} WHERE {where};".format(
+        attr=",".join(attr.values()),
+        tags=",".join("CASE WHEN {where} THEN 1 ELSE 0 END".format(where=get_where_clause(c)) for c in collection_configs),
+        table=collection_configs[0]["coll_table"],
+        where=get_shared_where_clause(collection_configs))
+
+@timed_stage("select")
+def select_shared_aggregates(collection_configs, aggregate):
+    # one aggregate per collection in one query, aggregate(where clause of the collection) -> sql expression
+    # returns coll_id -> value
+    sql = "SELECT {aggregates} FROM {table} WHERE {where};".format(
+        aggregates=",".join(aggregate(get_where_clause(c)) for c in collection_configs),
+        table=collection_configs[0]["coll_table"],
+        where=get_shared_where_clause(collection_configs))
+    db_connection = create_engine(url)
+    with db_connection.connect() as conn:
+        values = conn.execute(text(sql)).fetchone()
+    db_connection.dispose()
+    return {c["coll_id"]: v for c, v in zip(collection_configs, values)}
+
+def stream_shared_scan(collection_configs):
+    # Shared variant of stream_from_db: one server-side cursor for all collections of the group,
+    # every converted chunk is split into the rows of each collection (a list per collection, can be empty)
+    config = collection_configs[0]
+    tags = ["scan_tag_" + str(i) for i in range(len(collection_configs))]
+    convert_row = get_row_converter(list(config["coll_table_attributes"].keys()) + tags, config)
+    db_connection = create_engine(url)
+
+    with db_connection.connect() as conn:
+        cnt = 0
+        for chunk in read_chunks(conn, get_shared_select_statement(collection_configs), {}, convert_row, config):
+            cnt = cnt + len(chunk)
+            print(f"{str(cnt)} finished reading from db - {str(chunk[-1]['id'])} (shared by {len(collection_configs)} collections)")
+            yield [[r for r in chunk if r[tag]] for tag in tags]
+    db_connection.dispose()
+
+
+def get_partition_count(config):
+    # coll_partitions > 1 reads the collection with this many worker processes at the same time
+    # (not with a limit, which would apply to every range)
+    return config.get("coll_partitions", 1) if limit is None else 1
+
+@timed_stage("select")
+def select_partition_bounds(config, range_rows):
+    # Every range_rows-th id of the ordered ids, so every keyset range holds range_rows rows (the last one less).
+    # The last range is left open
+    attr = config["coll_table_attributes"]
+    sql = ("SELECT partition_id FROM (SELECT {id} AS partition_id, ROW_NUMBER() OVER (ORDER BY {id}) AS n "
+           "FROM {table} WHERE {where}) AS numbered WHERE n % {range_rows} = 0 ORDER BY 1;").format(
+        id=attr["id"], range_rows=int(range_rows), table=config["coll_table"], where=get_where_clause(config))
+    db_connection = create_engine(url)
+    with db_connection.connect() as conn:
+        bounds = [r[0] for r in conn.execute(text(sql))]
+    db_connection.dispose()
+    return bounds
+
+def init_partition_worker(db_url, stream_chunk_size):
+    # Runs once in every partition worker process, only the db is needed (processes are spawned on windows)
+    global url, chunk_size, partition_connection
+    import_dependencies()
+    url = db_url
+    chunk_size = stream_chunk_size
+    partition_connection = create_engine(url)
+
+def read_partition(config, changed_since, after, until):
+    # Partition worker process: selects and converts the rows of one keyset range, returns its chunks
+    convert_row = get_row_converter(config["coll_table_attributes"].keys(), config)
+    params = {"watermark": changed_since} if changed_since is not None else {}
+    params.update({k: v for k, v in [("after", after), ("until", until)] if v is not None})
+    with partition_connection.connect() as conn:
+        statement = get_select_statement(config, changed_since, after, False, until)
+        return list(read_chunks(conn, statement, params, convert_row, config, measured = False))
+
+def stream_partitions_from_db(config, changed_since = None):
+    # Partitioned variant of stream_from_db: the collection is split into keyset ranges of chunk_size rows,
+    # which coll_partitions worker processes select and convert (the conversion holds the GIL, so it runs
+    # in processes to use several cores). The chunks are yielded in the order they are ready, a few ranges
+    # per process are read ahead while the consumer indexes. The select stage contains the work of the processes.
+    partitions = get_partition_count(config)
+    bounds = select_partition_bounds(config, chunk_size)
+    ranges = list(zip([None] + bounds, bounds + [None]))
+    print(f"Reading {config['coll_id']} in {len(ranges)} ranges with {partitions} processes")
+    with ProcessPoolExecutor(max_workers = partitions, initializer = init_partition_worker, initargs = (url, chunk_size)) as executor:
+        pending = set()
+        try:
+            cnt = 0
+            while len(ranges) > 0 or len(pending) > 0:
+                while len(ranges) > 0 and len(pending) < 2 * partitions:
+                    after, until = ranges.pop(0)
+                    pending.add(executor.submit(read_partition, config, changed_since, after, until))
+                with stage("select"):
+                    done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    for chunk in future.result():
+                        count("rows", len(chunk))
+                        cnt = cnt + len(chunk)
+                        print(str(cnt) + " finished reading from db - " + str(chunk[-1]["id"]))
+                        yield chunk
+        finally:
+            # also when the consumer stops early or a range failed: ranges not started yet are dropped
+            for future in pending:
+                future.cancel()
+
+
+@timed_stage("select")
+def select_watermark(config):
+    # Highest value of the change tracking column, read before the items are selected
+    # (rows changing during the run are selected again next time)
+    attr = config["coll_table_attributes"]
+    db_connection = create_engine(url)
+    with db_connection.connect() as conn:
+        watermark = conn.execute(text("SELECT max({watermark}) FROM {table} WHERE {where};".format(
+            watermark=attr["watermark"], table=config["coll_table"], where=get_where_clause(config)))).scalar()
+    db_connection.dispose()
+    return to_watermark(watermark)
+
+def to_watermark(watermark):
+    # stored in the json state file
+    if isinstance(watermark, datetime):
+        return watermark.isoformat()
+    if isinstance(watermark, decimal.Decimal):
+        return float(watermark)
+    return watermark
+
+
+@timed_stage("select")
+def select_row_count(config):
+    # number of rows of the collection, for the progress of a run
+    db_connection = create_engine(url)
+    with db_connection.connect() as conn:
+        rows = conn.execute(text("SELECT count(*) FROM {table} WHERE {where};".format(
+            table=config["coll_table"], where=get_where_clause(config)))).scalar()
+    db_connection.dispose()
+    return rows if limit is None else min(rows, limit)
+
+@timed_stage("select")
+def select_ids_from_db(config):
+    # ids of all rows currently belonging to the collection
+    attr = config["coll_table_attributes"]
+    db_connection = create_engine(url)
+    ids = set()
+    with db_connection.connect() as conn:
+        df = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(text("SELECT {id} FROM {table} WHERE {where};".format(
+            id=attr["id"], table=config["coll_table"], where=get_where_clause(config))))
+        for rows in df.partitions(chunk_size):
+            ids.update(str(e[0]) for e in rows)
+    db_connection.dispose()
+    return ids
+
+
+def to_utc_datetime(dt):
+    if isinstance(dt, str):
+        dt = datetime.fromisoformat(dt)
+    if dt is None or dt.tzinfo is not None:
+        return dt
+    return dt.replace(tzinfo=timezone.utc)
+
+# (key, property name, summary strategy, column) of the columns the Summarizer summarizes (item:* and srid -> proj:epsg)
+def get_summary_columns(config):
+    summaryfields = Summarizer().summaryfields
+    columns = []
+    for key, column in config["coll_table_attributes"].items():
+        name = key.replace('item:', '') if key.startswith('item:') else None
+        if name in summaryfields:
+            columns.append((key, name, summaryfields[name], column))
+    # proj:epsg is added to the properties after the item:* columns (add_epsg)
+    if "srid" in config["coll_table_attributes"] and "proj:epsg" in summaryfields:
+        columns.append(("srid", "proj:epsg", summaryfields["proj:epsg"], config["coll_table_attributes"]["srid"]))
+    return columns
+
+def select_distinct(conn, table, column, max_count = None):
+    sql = "SELECT DISTINCT {c} FROM {table} ORDER BY {c}".format(c=column, table=table)
+    if max_count is not None:
+        sql = sql + " LIMIT " + str(max_count)
+    return [e[0] for e in conn.execute(text(sql + ";")) if e[0] is not None]
+
+# Pushdown: extent and summaries of the collection computed by the db (bbox of the geometries, min / max of the
+# datetime and summarized columns, distinct values of list summaries) - the same result as
+# Extent.from_items and Summarizer().summarize over all items, without reading the items
+@timed_stage("summarize")
+def select_collection_metadata(config):
+    attr = config["coll_table_attributes"]
+    table = "{table} WHERE {where}".format(table=config["coll_table"], where=get_where_clause(config))
+    if limit is not None:
+        table = "(SELECT * FROM {table} LIMIT {limit}) AS limited".format(table=table, limit=str(limit))
+    start_key = "item:start_datetime" if "item:start_datetime" in attr else "date"
+    end_key = "item:end_datetime" if "item:start_datetime" in attr else "date"
+    summary_columns = get_summary_columns(config)
+    aggregates = [
+        "min(ST_XMin({g}))".format(g=attr["geometry"]), "min(ST_YMin({g}))".format(g=attr["geometry"]),
+        "max(ST_XMax({g}))".format(g=attr["geometry"]), "max(ST_YMax({g}))".format(g=attr["geometry"]),
+        "min({c})".format(c=attr[start_key]) if start_key in attr else "NULL",
+        "max({c})".format(c=attr[end_key]) if end_key in attr else "NULL"
+    ]
+    for key, name, strategy, column in summary_columns:
+        aggregates += ["min({c})".format(c=column), "max({c})".format(c=column)]
+
+    convert_row = get_row_converter([k for k, n, s, c in summary_columns], config)
+    db_connection = create_engine(url)
+    with db_connection.connect() as conn:
+        values = list(conn.execute(text("SELECT {aggregates} FROM {table};".format(aggregates=",".join(aggregates), table=table))).first())
+        bbox, start, end = values[0:4], values[4], values[5]
+        # dates formatted as strings (coll_bs_date_format) can not be compared in the db
+        if start_key == "date" and isinstance(start, str):
+            dates = [datetime.strptime(d, config["coll_bs_date_format"]) for d in select_distinct(conn, table, attr["date"])]
+            start, end = min(dates), max(dates)
+
+        summaries = Summaries.empty()
+        minimum = convert_row(values[6::2])
+        maximum = convert_row(values[7::2])
+        for key, name, strategy, column in summary_columns:
+            if minimum[key] is None:
+                continue
+            if key == "srid":
+                minimum[key], maximum[key] = int(str(minimum[key])), int(str(maximum[key]))
+            if strategy == SummaryStrategy.RANGE or (strategy == SummaryStrategy.DEFAULT and isinstance(minimum[key], numbers.Number) and not isinstance(minimum[key], bool)):
+                summaries.add(name, RangeSummary(minimum[key], maximum[key]))
+                continue
+            # lists with at least maxcount values are not written (Summaries.to_dict), so no more are selected
+            distinct = select_distinct(conn, table, column, None if isinstance(minimum[key], list) else summaries.maxcount)
+            convert_value = get_row_converter([key], config)
+            summary = []
+            for v in distinct:
+                v = int(str(v)) if key == "srid" else convert_value([v])[key]
+                for element in (v if isinstance(v, list) else [v]):
+                    if element not in summary:
+                        summary.append(element)
+            summaries.add(name, summary)
+    db_connection.dispose()
+
+    extent = pystac.Extent(spatial = pystac.SpatialExtent([[float(b) for b in bbox]]),
+                           temporal = pystac.TemporalExtent([[to_utc_datetime(start), to_utc_datetime(end)]]))
+    return extent, summaries
+
+
 def add_asset(item, config, bsid, item_object):
     for asset in config["assets"]:
         title = asset["title"].format(id=bsid) if "title" in asset.keys() else asset["id_format"].format(id=bsid)
@@ -238,8 +1121,8 @@ def create_item(bsid, bs, config):
 
     item = pystac.Item(
         id = bsid,
-        geometry = shapely.geometry.mapping(bs["geometry"]),
-        bbox = Polygon(bs["geometry"]).bounds,
+        geometry = bs["geometry_geojson"],
+        bbox = bs["geometry_bbox"],
         datetime = date,
         properties = {
             k.replace('item:', ''): bs[k]
@@ -254,13 +1137,14 @@ def create_item(bsid, bs, config):
     return item
 
 
+@timed_stage("items")
 def get_items(bs, config):
     items = []
     cnt = 0
     for bsid in bs:
         bs_data = bs[bsid]
         item = create_item(bsid, bs_data, config)
-        item = add_epsg(item, str(bs_data["srid"]))
+        item = add_epsg(item, str(bs_data["srid"]), bs_data.get("proj_geometry"), bs_data.get("proj_bbox"))
         cnt = cnt + 1
         items.append(item)
     return items
@@ -288,7 +1172,7 @@ def initialize_collection(config, bs, providers):
 
    
     collection = pystac.Collection(
-        id=coll_id,
+        id=config["coll_id"],
         title=config["coll_title"],
         description=config["coll_description"] + mission_description,
         extent=pystac.Extent(spatial=None, temporal=None),
@@ -313,7 +1197,7 @@ def add_thumbnail_to_collection(collection, config):
     return collection
 
 
-def fill_config_template(config):
+def fill_config_template(config, current_config):
     if "collection_template" not in current_config.keys(): return config
     temp = current_config["collection_template"].copy()
     for key in temp.keys():
@@ -326,17 +1210,20 @@ def get_catalog_path(catalog, root, str):
     return parent_catalog_config["href"]
 
 def get_collection_path(collection, root, str):
-    return parent_catalog_config["href"] + "collections/" + collection.to_dict()["id"]
+    return parent_catalog_config["href"] + "collections/" + collection.id
 
 def get_item_path(item, root, str = None):
-    return parent_catalog_config["href"] + "collections/" +  item.to_dict()["collection"] + "/items/" + item.to_dict()["id"]
+    return get_item_href(item.collection_id, item.id)
+
+def get_item_href(collection_id, item_id):
+    return parent_catalog_config["href"] + "collections/" + collection_id + "/items/" + item_id
 
-def tidy_up_collection_links(collection: pystac.Collection):
+def tidy_up_collection_links(collection: "pystac.Collection"):
     collection.remove_links(pystac.RelType.ITEM)
     collection.add_link(pystac.Link(pystac.RelType.ITEMS, parent_catalog_config["href"] + "collections/" +  collection.id + "/items", media_type= "application/json", title= "Get all items of this collection"))
     return collection
 
-def tidy_up_catalog_links(catalog: pystac.Catalog):
+def tidy_up_catalog_links(catalog: "pystac.Catalog"):
     links = [
             pystac.Link("prov", parent_catalog_config["provider_website"], media_type= "text/html", title= parent_catalog_config["provider_website_title"]),
             pystac.Link("data", parent_catalog_config["href"] + "collections", media_type= "application/json", title= "Get all collections of this catalog"),
@@ -361,108 +1248,977 @@ def create_collection(collection_config):
     item_data = select_from_db(collection_config)
     collection = initialize_collection(
         collection_config, item_data, get_providers(collection_config, item_data))
-    collection.add_items(get_items(item_data, collection_config),
-                        strategy = CustomLayoutStrategy(catalog_func=get_catalog_path, collection_func=get_collection_path, item_func=get_item_path))
-    collection.update_extent_from_items()
-    collection.summaries = Summarizer().summarize(collection)
+    count("items", len(item_data))
+    item_wkts[collection.id] = {bsid: bs["geometry_wkt"] for bsid, bs in item_data.items()}
+    with stage("items"):
+        collection.add_items(get_items(item_data, collection_config),
+                            strategy = CustomLayoutStrategy(catalog_func=get_catalog_path, collection_func=get_collection_path, item_func=get_item_path))
+    if pushdown:
+        collection.extent, collection.summaries = select_collection_metadata(collection_config)
+    else:
+        with stage("summarize"):
+            collection.update_extent_from_items()
+            collection.summaries = Summarizer().summarize(collection)
     collection = add_thumbnail_to_collection(collection, collection_config)
     return collection
 
+# Sets the links of a streamed item the same way collection.add_items + get_items do,
+# but without registering the item in the catalog's object cache (which would keep every item alive)
+def link_item(item, collection):
+    item.set_self_href(get_item_path(item, None))
+    item.set_collection(collection)
+    item.set_parent(collection)
+    item.links.insert(0, pystac.Link.root(collection.get_root()))
+    return item
+
+# Streaming variant of create_collection: the collection is added to the catalog first,
+# then every chunk read from the db is converted to items and indexed; items are not added to the collection.
+# Extent and summaries are accumulated chunk by chunk, so only one chunk of items is held in memory.
+def stream_collection(collection_config):
+    checkpoint = read_checkpoint("collection_" + collection_config["coll_id"])
+    if checkpoint is not None and checkpoint["status"] == "indexing":
+        return resume_stream_collection(collection_config, checkpoint)
+
+    # with checkpoints the rows are read in the order of the ids, so a resumed run can continue after the last chunk
+    # (partitioned collections are read in parallel and only checkpointed once they are finished)
+    checkpoint_chunks = checkpoint_filepath is not None and get_partition_count(collection_config) <= 1
+    chunks = stream_from_db(collection_config, ordered = checkpoint_chunks)
+    first_chunk = next(chunks, [])
+    if len(first_chunk) == 0:
+        print("No data found in db - check table and / or select statement")
+        raise Exception("No data in db")
+
+    collection = start_stream_collection(collection_config, first_chunk[0])
+    index_item_chunks(collection, itertools.chain([first_chunk], chunks), collection_config, checkpoint = checkpoint_chunks)
+    items_indexed.add(collection.id)
+    return collection
+
+def start_stream_collection(collection_config, first_row):
+    # the collection is created from the first row read, added to the catalog and its old documents are removed
+    first_row = {first_row["id"]: first_row}
+    collection = initialize_collection(
+        collection_config, first_row, get_providers(collection_config, first_row))
+    collection = add_thumbnail_to_collection(collection, collection_config)
+    catalog.add_child(collection, strategy = CustomLayoutStrategy(catalog_func = get_catalog_path, collection_func= get_collection_path, item_func=get_item_path))
+    remove_collection_from_solr(collection.id)
+    return collection
+
+# Shared scan variant of stream_collection for collections that only differ in coll_tabelle_where
+# (see get_shared_scan_key): the table is read once, every chunk is split into the rows of each collection
+# and pushed to its ItemChunkIndexer. The scan (select, convert) is measured in the first collection
+def stream_collections(collection_configs):
+    indexers = [None] * len(collection_configs)
+    scan = stream_shared_scan(collection_configs)
+    while True:
+        with measure("Collection", collection_configs[0]["coll_id"]):
+            chunks = next(scan, None)
+        if chunks is None:
+            break
+        for i, chunk in enumerate(chunks):
+            if len(chunk) == 0:
+                continue
+            with measure("Collection", collection_configs[i]["coll_id"]):
+                count("rows", len(chunk))
+                if indexers[i] is None:
+                    indexers[i] = ItemChunkIndexer(start_stream_collection(collection_configs[i], chunk[0]), collection_configs[i])
+                indexers[i].add(chunk)
+
+    collections = []
+    for collection_config, indexer in zip(collection_configs, indexers):
+        if indexer is None:
+            print(f"No data found in db for {collection_config['coll_id']} - check table and / or select statement")
+            raise Exception("No data in db")
+        with measure("Collection", collection_config["coll_id"]):
+            collection = indexer.finish()
+        items_indexed.add(collection.id)
+        collections.append(collection)
+    return collections
+
+# Continues a streamed collection of a failed run after the last chunk in the checkpoint journal:
+# the documents indexed before are kept (not deleted again), extent and summaries continue from the checkpoint
+def resume_stream_collection(collection_config, checkpoint):
+    coll_id = collection_config["coll_id"]
+    print(f"Resuming Collection {coll_id} after {checkpoint['after']} ({checkpoint['rows']} rows indexed)")
+    collection = pystac.Collection.from_dict(checkpoint["collection"])
+    collection.summaries = Summaries(checkpoint["summaries"])
+    catalog.add_child(collection, strategy = CustomLayoutStrategy(catalog_func = get_catalog_path, collection_func= get_collection_path, item_func=get_item_path))
+
+    if solr_indexer.generation is not None:
+        replaced_collections.add(coll_id)
+    if content_hashes:
+        indexed_hashes[coll_id] = get_indexed_item_hashes(coll_id)
+    chunks = stream_from_db(collection_config, after = checkpoint["after"], ordered = True)
+    index_item_chunks(collection, chunks, collection_config, checkpoint = True, rows = checkpoint["rows"])
+    if content_hashes:
+        # the items before the checkpoint were not generated again in this run, so only the ids
+        # no longer in the db are deleted
+        removed_ids = get_indexed_item_ids(coll_id) - select_ids_from_db(collection_config)
+        indexed_hashes[coll_id] = {"item_" + coll_id + "_" + i: None for i in removed_ids}
+    items_indexed.add(collection.id)
+    return collection
+
+# Fast path for streamed items: returns a function rendering the item dict (the same as link_item(create_item(...)).to_dict())
+# straight from a row, without pystac objects. Links are copied from an item built with pystac once per collection,
+# only the self href is computed from the ids. The first rows are rendered both ways and compared,
+# if they differ (e.g. a config using features the renderer does not know) None is returned and pystac is used.
+def get_item_renderer(collection, collection_config, rows):
+    bs = {r["id"]: r for r in rows[:2]}
+    expected = [link_item(i, collection).to_dict() for i in get_items(bs, collection_config)]
+    template = expected[0]
+    links = template["links"]
+    self_link = [l["rel"] for l in links].index("self")
+    stac_extensions = template.get("stac_extensions")
+    stac_version = pystac.get_stac_version()
+
+    def render(bs):
+        bsid = bs["id"]
+        properties = {k.replace('item:', ''): bs[k] for k in bs.keys() if k.startswith('item:')}
+        properties["proj:epsg"] = int(str(bs["srid"]))
+        if bs["proj_geometry"] is not None:
+            properties["proj:geometry"] = bs["proj_geometry"]
+        if bs["proj_bbox"] is not None:
+            properties["proj:bbox"] = list(bs["proj_bbox"])
+        date = None if "item:start_datetime" in bs.keys() else bs["date"]
+        properties["datetime"] = datetime_to_str(date) if date is not None else None
+
+        assets = {}
+        for asset in collection_config["assets"]:
+            a = {"href": asset['url'].format(filename=bs["filename"], filetype=asset["filetype"], folder=bs["folder"] if "folder" in bs.keys() else ""),
+                 "type": asset["mediatype"],
+                 "title": asset["title"].format(id=bsid) if "title" in asset.keys() else asset["id_format"].format(id=bsid)}
+            if "description" in asset.keys() and asset["description"] is not None:
+                a["description"] = asset["description"]
+            a["roles"] = asset["roles"]
+            assets[asset["id_format"].format(id=bsid)] = a
+
+        item_links = [dict(l) for l in links]
+        item_links[self_link]["href"] = get_item_href(collection.id, bsid)
+        d = {
+            "type": "Feature",
+            "stac_version": stac_version,
+            "id": bsid,
+            "properties": properties,
+            "geometry": bs["geometry_geojson"],
+            "links": item_links,
+            "assets": assets,
+            "bbox": bs["geometry_bbox"]
+        }
+        if stac_extensions is not None:
+            d["stac_extensions"] = list(stac_extensions)
+        d["collection"] = collection.id
+        return d
+
+    for e, r in zip(expected, bs.values()):
+        if json.dumps(render(r)) != json.dumps(e):
+            logging.warning(f"Items of {collection.id} are created with pystac (fast item json differs)")
+            return None
+    return render
+
+# Extent.from_items for item dicts
+def get_extent_from_item_dicts(item_dicts):
+    bboxes = [d["bbox"] for d in item_dicts if d.get("bbox") is not None]
+    datetimes = [str_to_datetime(d["properties"]["datetime"]) for d in item_dicts if d["properties"].get("datetime") is not None]
+    starts = [str_to_datetime(d["properties"]["start_datetime"]) for d in item_dicts if d["properties"].get("start_datetime") is not None]
+    ends = [str_to_datetime(d["properties"]["end_datetime"]) for d in item_dicts if d["properties"].get("end_datetime") is not None]
+    utc = lambda dt: dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+    spatial = pystac.SpatialExtent([[
+        min([float("inf")] + [b[0] for b in bboxes]),
+        min([float("inf")] + [b[1] for b in bboxes]),
+        max([float("-inf")] + [b[2] for b in bboxes]),
+        max([float("-inf")] + [b[3] for b in bboxes])
+    ]])
+    start = min([utc(dt) for dt in datetimes + starts]) if any(datetimes + starts) else None
+    end = max([utc(dt) for dt in datetimes + ends]) if any(datetimes + ends) else None
+    return pystac.Extent(spatial = spatial, temporal = pystac.TemporalExtent([[start, end]]))
+
+# Indexes the items of a collection chunk by chunk and extends extent and summaries of the collection.
+# Chunks are pushed (add), so one pass over a table can feed several collections (see stream_collections)
+class ItemChunkIndexer:
+    def __init__(self, collection, collection_config, checkpoint = False, rows = 0):
+        self.collection = collection
+        self.collection_config = collection_config
+        self.checkpoint = checkpoint
+        self.summarizer = Summarizer()
+        self.summaries = collection.summaries if not collection.summaries.is_empty() else Summaries.empty()
+        self.extent = collection.extent if collection.extent.spatial is not None else None
+        self.render = None
+        self.first = True
+        self.cnt = rows
+
+    def add(self, chunk):
+        collection = self.collection
+        if self.first:
+            self.first = False
+            with stage("items"):
+                self.render = get_item_renderer(collection, self.collection_config, chunk)
+        if self.render is not None:
+            with stage("items"):
+                item_dicts = [self.render(r) for r in chunk]
+            count("items", len(item_dicts))
+            with stage("serialize"):
+                documents = [get_item_document_from_dict(d, r["geometry_wkt"]) for d, r in zip(item_dicts, chunk)]
+            add2solr(documents)
+            if not pushdown:
+                with stage("summarize"):
+                    self.extent = merge_extents(self.extent, get_extent_from_item_dicts(item_dicts))
+                    # the summarizer only reads item.properties
+                    self.summaries = merge_summaries(self.summaries, self.summarizer.summarize([SimpleNamespace(properties=d["properties"]) for d in item_dicts]))
+        else:
+            bs = {r["id"]: r for r in chunk}
+            with stage("items"):
+                items = [link_item(i, collection) for i in get_items(bs, self.collection_config)]
+            count("items", len(items))
+            add2solr([get_item_document(i, bs[i.id]["geometry_wkt"]) for i in items])
+            if not pushdown:
+                with stage("summarize"):
+                    self.extent = merge_extents(self.extent, pystac.Extent.from_items(items))
+                    self.summaries = merge_summaries(self.summaries, self.summarizer.summarize(items))
+
+        self.cnt = self.cnt + len(chunk)
+        print(f"{str(self.cnt)}: Added items to lucene ({collection.id})")
+        report_progress(collection.id)
+        if self.checkpoint:
+            write_chunk_checkpoint(collection, chunk[-1]["id"], self.cnt, self.extent, self.summaries)
+
+    def finish(self):
+        collection = self.collection
+        if pushdown:
+            # computed over the whole table, so also correct for incremental updates (e.g. after deletions)
+            collection.extent, collection.summaries = select_collection_metadata(self.collection_config)
+            return collection
+        if self.extent is not None:
+            collection.extent = self.extent
+        collection.summaries = self.summaries
+        return collection
+
+def index_item_chunks(collection, chunks, collection_config, checkpoint = False, rows = 0):
+    indexer = ItemChunkIndexer(collection, collection_config, checkpoint, rows)
+    for chunk in chunks:
+        indexer.add(chunk)
+    return indexer.finish()
+
+# Incremental update of an indexed collection: the collection is read back from solr,
+# only rows changed since the stored watermark are selected and upserted,
+# items whose ids are no longer in the db are deleted.
+# Extent and summaries are extended with the changed items (deleted items do not shrink them),
+# with pushdown they are computed again in the db.
+def update_collection(collection_config, collection_state):
+    coll_id = collection_config["coll_id"]
+    c_dict = get_indexed_collection(coll_id)
+    if c_dict is None:
+        return None
+
+    print(f"Updating Collection {coll_id} (changes since {collection_state['watermark']})")
+    collection = pystac.Collection.from_dict(c_dict)
+    collection.remove_links(pystac.RelType.ITEMS)
+    catalog.add_child(collection, strategy = CustomLayoutStrategy(catalog_func = get_catalog_path, collection_func= get_collection_path, item_func=get_item_path))
+
+    index_item_chunks(collection, stream_from_db(collection_config, collection_state["watermark"]), collection_config)
+    # lists that exceeded the maximum count are not in the stored json any more and must stay out
+    # (pushdown recomputes all summaries)
+    if not pushdown:
+        for key in collection_state.get("summaries_overflow", []):
+            if collection.summaries.get_list(key) is not None:
+                collection.summaries.remove(key)
+
+    removed_ids = get_indexed_item_ids(coll_id) - select_ids_from_db(collection_config)
+    if len(removed_ids) > 0:
+        print(f"Removing {len(removed_ids)} items from lucene ({coll_id})")
+        solr_indexer.delete(id = ["item_" + coll_id + "_" + i for i in removed_ids])
+
+    items_indexed.add(collection.id)
+    return collection
+
+def get_collection_state(watermark, collection, previous_state = None):
+    # watermark and the summary lists that exceeded the maximum count (see update_collection)
+    overflow = set(previous_state.get("summaries_overflow", [])) if previous_state and not pushdown else set()
+    for key, values in collection.summaries.lists.items():
+        if len(values) >= collection.summaries.maxcount:
+            overflow.add(key)
+    return {
+        "watermark": watermark,
+        "summaries_overflow": sorted(overflow)
+    }
+
+def register_collection(collection_config):
+    # options of the collection used when its documents are built
+    coll_id = collection_config["coll_id"]
+    if collection_config.get("coll_geometry_index", "geometry") == "envelope":
+        envelope_collections.add(coll_id)
+    if parent_catalog_config.get("solr_property_fields", False):
+        property_fields[coll_id] = [k.replace('item:', '') for k in collection_config["coll_table_attributes"] if k.startswith('item:')]
+
+def build_collection(collection_config):
+    # Creates the collection (or updates it incrementally) and adds it to the catalog
+    coll_id = collection_config["coll_id"]
+    register_collection(collection_config)
+    with measure("Collection", coll_id):
+        use_watermark = incremental and "watermark" in collection_config["coll_table_attributes"]
+        if use_watermark:
+            watermark = select_watermark(collection_config)
+
+        collection = None
+        previous_state = incremental_state.get(coll_id)
+        if use_watermark and previous_state is not None:
+            collection = update_collection(collection_config, previous_state)
+        if collection is None:
+            print(f"Creating new Collection {coll_id}")
+            if progress_output:
+                collection_totals[coll_id] = select_row_count(collection_config)
+            if streaming:
+                # stream_collection adds the collection to the catalog itself
+                collection = stream_collection(collection_config)
+            else:
+                collection = create_collection(collection_config)
+                catalog.add_child(collection, strategy = CustomLayoutStrategy(catalog_func = get_catalog_path, collection_func= get_collection_path, item_func=get_item_path))
+
+        if use_watermark:
+            incremental_state[coll_id] = get_collection_state(watermark, collection, previous_state)
+        return collection
+
+def build_shared_scan_collections(collection_configs):
+    # Creates the (new) collections of a shared scan group with one pass over the table and adds them to the catalog
+    for collection_config in collection_configs:
+        register_collection(collection_config)
+        print(f"Creating new Collection {collection_config['coll_id']}")
+    use_watermark = incremental and "watermark" in collection_configs[0]["coll_table_attributes"]
+    with measure("Collection", collection_configs[0]["coll_id"]):
+        if use_watermark:
+            watermark_column = collection_configs[0]["coll_table_attributes"]["watermark"]
+            watermarks = select_shared_aggregates(collection_configs, lambda where: f"max(CASE WHEN {where} THEN {watermark_column} END)")
+        if progress_output:
+            rows = select_shared_aggregates(collection_configs, lambda where: f"sum(CASE WHEN {where} THEN 1 ELSE 0 END)")
+            collection_totals.update((coll_id, n or 0) for coll_id, n in rows.items())
+
+    collections = stream_collections(collection_configs)
+    if use_watermark:
+        for collection in collections:
+            incremental_state[collection.id] = get_collection_state(to_watermark(watermarks[collection.id]), collection)
+    return collections
+
+def read_incremental_state(state_filepath):
+    if not os.path.exists(state_filepath):
+        return {}
+    with open(state_filepath, mode="r", encoding="utf-8") as file:
+        return json.load(file)
+
+def write_incremental_state(state_filepath):
+    with open(state_filepath, mode="w", encoding="utf-8") as file:
+        json.dump(incremental_state, file, indent=4)
+
+# CHECKPOINTS
+
+# Journal of the run in a sqlite file, written by the main and the worker processes:
+# finished collections (status "done": the collection without items and its incremental state),
+# in streaming mode the last chunk acknowledged by solr (status "indexing": id of its last row, extent and summaries so far)
+# and the generation of the run. --resume skips finished collections and continues streamed ones after the last chunk.
+# The journal is cleared when a run starts without --resume and after a successful run.
+# Documents sent to solr but not committed yet are kept by solr (update log) and become visible with the next commit.
+def configure_checkpoints(filepath, resume_run = False):
+    global checkpoint_filepath, resume
+    checkpoint_filepath = filepath
+    resume = resume_run
+
+@contextmanager
+def open_checkpoints():
+    conn = sqlite3.connect(checkpoint_filepath, timeout = 60)
+    try:
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS checkpoints (key TEXT PRIMARY KEY, status TEXT, data TEXT)")
+            yield conn
+    finally:
+        conn.close()
+
+def read_checkpoint(key):
+    # checkpoints are only used with --resume
+    if checkpoint_filepath is None or not resume:
+        return None
+    with open_checkpoints() as conn:
+        row = conn.execute("SELECT status, data FROM checkpoints WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    return dict(json.loads(row[1]), status = row[0])
+
+def write_checkpoint(key, status, data):
+    if checkpoint_filepath is None:
+        return
+    with open_checkpoints() as conn:
+        conn.execute("INSERT OR REPLACE INTO checkpoints (key, status, data) VALUES (?, ?, ?)", (key, status, json.dumps(data)))
+
+def clear_checkpoints():
+    if checkpoint_filepath is None:
+        return
+    with open_checkpoints() as conn:
+        conn.execute("DELETE FROM checkpoints")
+
+def get_summaries_dict(summaries):
+    # like Summaries.to_dict, but keeps the lists exceeding maxcount (they can still be needed)
+    d = dict(summaries.lists)
+    d.update({key: value_range.to_dict() for key, value_range in summaries.ranges.items()})
+    d.update(summaries.schemas)
+    return d
+
+def write_chunk_checkpoint(collection, last_id, rows, extent, summaries):
+    # the extent so far is stored with the collection (with pushdown it is computed in the db at the end, any extent will do)
+    collection.extent = extent if extent is not None else pystac.Extent(pystac.SpatialExtent([[0, 0, 0, 0]]), pystac.TemporalExtent([[None, None]]))
+    data = {
+        "after": last_id,
+        "rows": rows,
+        "collection": collection.to_dict(),
+        "summaries": get_summaries_dict(summaries)
+    }
+    # the chunk is only recorded once solr acknowledged its documents, reading the next chunks goes on meanwhile
+    solr_indexer.after_acknowledged(lambda: write_checkpoint("collection_" + collection.id, "indexing", data))
+
+def resume_finished_collection(checkpoint):
+    # collection finished before the failure: added to the catalog again, but not indexed again
+    collection = pystac.Collection.from_dict(checkpoint["collection"])
+    if checkpoint["state"] is not None:
+        incremental_state[collection.id] = checkpoint["state"]
+    print(f"Skipping finished Collection {collection.id}")
+    return collection
+
 # SOLR FUNCTIONALITY
 
+# Buffers documents and sends them to solr in batches instead of one request per document.
+# A batch is sent when it holds batch_size documents or roughly batch_bytes bytes.
+# Without commit_within / soft_commit nothing becomes visible until the hard commit at the end of the run.
+# With a generation (solr_reindex "generation") every document is tagged with the generation of the run.
+# With writers > 1 the batches are sent by that many threads from a bounded queue, so generation only waits
+# when the queue is full. Deletes and commits wait until every batch before them is acknowledged (solr applies
+# updates in the order they arrive). Failed requests are retried with backoff, the batch size adapts to the
+# latency of solr: halved when a request takes longer than target_latency or fails, grown when it is fast.
+class SolrIndexer:
+    def __init__(self, solr_conn, batch_size = 500, batch_bytes = 10000000, commit_within = None, soft_commit = False, optimize = False,
+                 writers = 1, max_batch_size = 5000, target_latency = 2.0, retries = 3, retry_backoff = 1.0):
+        self.solr_conn = solr_conn
+        self.generation = None
+        self.batch_size = batch_size
+        self.min_batch_size = max(1, batch_size // 10)
+        self.max_batch_size = max(batch_size, max_batch_size)
+        self.batch_bytes = batch_bytes
+        self.commit_within = commit_within
+        self.soft_commit = soft_commit
+        self.optimize = optimize
+        self.writers = writers
+        self.target_latency = target_latency
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.queue = None
+        self.threads = []
+        self.error = None
+        # batches are numbered in the order they are sent, acknowledged = every batch up to this number
+        # is acknowledged by solr (writers finish out of order, done holds the numbers above it)
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.acknowledged = 0
+        self.done = set()
+        # (batch number, callback) registered with after_acknowledged
+        self.callbacks = []
+
+    def add(self, document2index):
+        if self.generation is not None:
+            document2index["generation"] = self.generation
+        self.buffer.append(document2index)
+        document_bytes = sum(len(str(v)) for v in document2index.values())
+        self.buffer_bytes += document_bytes
+        count("documents")
+        count("solr_bytes", document_bytes)
+        if len(self.buffer) >= self.batch_size or self.buffer_bytes >= self.batch_bytes:
+            self.send_buffer()
+
+    def send_buffer(self):
+        if len(self.buffer) == 0:
+            return
+        count("solr_requests")
+        batch = self.buffer
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.sent += 1
+        with stage("index"):
+            if self.writers > 1:
+                self.start_writers()
+                # blocks while the queue is full (backpressure)
+                self.queue.put((self.sent, batch))
+            else:
+                self.send(batch)
+                self.acknowledge(self.sent)
+        self.raise_error()
+        self.run_callbacks()
+
+    def flush(self):
+        # sends the buffer and waits until solr acknowledged every batch sent so far
+        self.send_buffer()
+        if self.queue is not None:
+            with stage("index"):
+                self.queue.join()
+            self.raise_error()
+        self.run_callbacks()
+
+    def after_acknowledged(self, callback):
+        # callback (e.g. a checkpoint) runs in this thread once solr acknowledged every document added so far,
+        # without waiting for the writers - it is called by a later send_buffer or flush
+        self.callbacks.append((self.sent + (1 if len(self.buffer) > 0 else 0), callback))
+        self.run_callbacks()
+
+    def acknowledge(self, number):
+        with self.lock:
+            self.done.add(number)
+            while self.acknowledged + 1 in self.done:
+                self.acknowledged += 1
+                self.done.remove(self.acknowledged)
+
+    def run_callbacks(self):
+        with self.lock:
+            acknowledged = self.acknowledged
+        while len(self.callbacks) > 0 and self.callbacks[0][0] <= acknowledged:
+            self.callbacks.pop(0)[1]()
+
+    def send(self, batch):
+        latency = self.retry(self.solr_conn.add, batch, commit = False, commitWithin = self.commit_within)
+        # only full batches tell if the batch size fits (additive increase, multiplicative decrease)
+        with self.lock:
+            if len(batch) >= self.batch_size:
+                if latency > self.target_latency:
+                    self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+                elif latency < self.target_latency / 2:
+                    self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.batch_size // 4))
+
+    def retry(self, request, *args, **kwargs):
+        # returns the seconds of the successful request, raises after the last retry
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                request(*args, **kwargs)
+                return time.perf_counter() - start
+            except pysolr.SolrError as e:
+                with self.lock:
+                    self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Solr request failed, retry {attempt + 1} of {self.retries}: {e}")
+                time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def start_writers(self):
+        if self.queue is not None:
+            return
+        self.queue = queue.Queue(maxsize = 2 * self.writers)
+        self.threads = [threading.Thread(target = self.write_batches, daemon = True) for i in range(self.writers)]
+        for thread in self.threads:
+            thread.start()
+
+    def close(self):
+        # stops the writer threads after the queued batches (None = stop), buffered documents are not sent (see flush),
+        # the next batch starts new threads
+        if self.queue is None:
+            return
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.queue = None
+        self.threads = []
+
+    def write_batches(self):
+        # writer thread (no metrics, they are not thread-safe). After a failed batch the following ones
+        # are dropped (never acknowledged), the error is raised in the generating thread and the run fails
+        while True:
+            task = self.queue.get()
+            if task is None:
+                self.queue.task_done()
+                return
+            number, batch = task
+            try:
+                if self.error is None:
+                    self.send(batch)
+                    self.acknowledge(number)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def raise_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def delete(self, **kwargs):
+        # buffered and queued documents are sent first, solr applies updates in the order they arrive
+        self.flush()
+        with stage("index"):
+            self.retry(self.solr_conn.delete, commit = False, **kwargs)
+
+    def collection_finished(self):
+        # makes a finished collection searchable while the run continues
+        if self.soft_commit:
+            self.flush()
+            with stage("index"):
+                self.retry(self.solr_conn.commit, softCommit = True)
+
+    def commit(self):
+        # single hard commit at the end of the run, optimize is opt-in
+        try:
+            self.flush()
+        finally:
+            self.close()
+        with stage("index"):
+            self.retry(self.solr_conn.commit)
+            if self.optimize:
+                self.retry(self.solr_conn.optimize)
+
+# Export mode: same interface as SolrIndexer, but the documents are written to NDJSON files (one document per line)
+# which load_solr_ndjson.py sends to solr later. Deletes are written as solr json update commands ({"delete": ...}),
+# so a load replays the run in the same order. Every process writes its own shards (documents-<run>-<pid>-<n>.ndjson[.gz]),
+# a collection is always built by one process, so its deletes and documents are in the same file sequence. The zero-padded
+# run number (see get_export_run) sorts the shards of a resumed run after those of the failed run.
+class NdjsonExporter:
+    def __init__(self, export_directory, shard_size = 100000, compress = True):
+        self.export_directory = export_directory
+        self.shard_size = shard_size
+        self.compress = compress
+        self.generation = None
+        self.file = None
+        self.shard = 0
+        self.shard_documents = 0
+
+    def get_shard_filepath(self):
+        filename = f"documents-{export_run:04d}-{os.getpid()}-{self.shard:05d}.ndjson" + (".gz" if self.compress else "")
+        return os.path.join(self.export_directory, filename)
+
+    def write(self, line):
+        if self.file is None:
+            os.makedirs(self.export_directory, exist_ok = True)
+            filepath = self.get_shard_filepath()
+            while os.path.exists(filepath):
+                # shards written by a process with the same id in this run
+                self.shard += 1
+                filepath = self.get_shard_filepath()
+            self.file = gzip.open(filepath, "wt", encoding = "utf-8", compresslevel = 5) if self.compress else open(filepath, "w", encoding = "utf-8")
+            self.shard += 1
+            self.shard_documents = 0
+        with stage("index"):
+            self.file.write(line + "\n")
+        self.shard_documents += 1
+        count("solr_bytes", len(line) + 1)
+
+    def add(self, document2index):
+        if self.generation is not None:
+            document2index["generation"] = self.generation
+        count("documents")
+        self.write(to_json_string(document2index))
+        if self.shard_documents >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        # closes the current shard, the next document starts a new one
+        if self.file is not None:
+            with stage("index"):
+                self.file.close()
+            self.file = None
+
+    def after_acknowledged(self, callback):
+        # written synchronously, the documents only have to reach the file
+        self.sync()
+        callback()
+
+    def sync(self):
+        # writes the buffered documents to the current shard without closing it (a gzip shard is readable up to here,
+        # the shard size is kept)
+        if self.file is not None:
+            with stage("index"):
+                self.file.flush()
+
+    def delete(self, id = None, q = None):
+        if id is not None:
+            self.write(json.dumps({"delete": id if isinstance(id, list) else {"id": id}}))
+        if q is not None:
+            self.write(json.dumps({"delete": {"query": q}}))
+
+    def collection_finished(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def commit(self):
+        # the commit is done by the loader
+        self.flush()
+
+def remove_exported_files(export_directory):
+    # shards of an earlier export would be loaded again
+    for filepath in glob.glob(os.path.join(export_directory, "documents-*.ndjson*")):
+        os.remove(filepath)
+
+def get_export_run(export_directory):
+    # next run number after the shards in the directory (1 for an empty directory)
+    runs = [int(m.group(1)) for m in (re.match(r"documents-(\d+)-\d+-\d+\.ndjson", os.path.basename(f))
+                                      for f in glob.glob(os.path.join(export_directory, "documents-*.ndjson*"))) if m]
+    return max(runs, default = 0) + 1
+
 def add2solr(document2index):
-    if document2index != None:
-        solr_conn.add(document2index)
+    if document2index == None:
+        return
+    if isinstance(document2index, list):
+        for d in document2index:
+            if not is_unchanged(d):
+                solr_indexer.add(d)
+    elif not is_unchanged(document2index):
+        solr_indexer.add(document2index)
+
+def get_content_hash(document2index):
+    # every indexed field of the item document (e.g. also the typed property fields), except the hash
+    # itself and the generation of the run
+    fields = {k: v for k, v in document2index.items() if k not in ("content_hash", "generation")}
+    return hashlib.sha1(json.dumps(fields, sort_keys = True, separators = (",", ":"), default = str).encode("utf-8")).hexdigest()
+
+def is_unchanged(document2index):
+    # hash mode: item documents with the same content hash as in solr are not sent again
+    if not content_hashes or "collection" not in document2index:
+        return False
+    document2index["content_hash"] = get_content_hash(document2index)
+    hashes = indexed_hashes.get(document2index["collection"])
+    if hashes is not None and hashes.pop(document2index["uniqueid"], None) == document2index["content_hash"]:
+        count("documents_unchanged")
+        return True
+    return False
 
 def index_catalog():
-    document2index = None
-    clean_catalog = tidy_up_catalog_links(catalog)
-    c_dict = clean_catalog.to_dict()
-    print("Add catalog to lucene " + c_dict["id"])
+    with measure("Catalog", catalog.id):
+        document2index = None
+        clean_catalog = tidy_up_catalog_links(catalog)
+        c_dict = clean_catalog.to_dict()
+        print("Add catalog to lucene " + c_dict["id"])
+        document2index = {
+            'uniqueid': "catalog_"+c_dict["id"],
+            'id': c_dict["id"],
+            'type': c_dict["type"],
+            'description': c_dict["description"],
+            'json_string': to_json_string(c_dict)
+        }
+        add2solr(document2index)
+        solr_indexer.commit()
+    finish_metrics("Catalog", catalog.id)
+
+def index_collection(c):
+    with measure("Collection", c.id):
+        # streamed and incrementally updated collections have their items indexed already
+        if c.id not in items_indexed:
+            remove_collection_from_solr(c.id)
+            index_items(c)
+        c = tidy_up_collection_links(c)
+        c_dict = c.to_dict()
+
+        print("Add collection to lucene " + c_dict["id"])
+        document2index = {
+            'uniqueid': "collection_"+c_dict["id"],
+            'id': c_dict["id"],
+            'type': c_dict["type"],
+            'datetime': c_dict["extent"]["temporal"]["interval"][0],
+            'bbox': shapely.geometry.box(*c_dict["extent"]["spatial"]["bbox"][0]).wkt,
+            'description': c_dict["description"],
+            'keywords': c_dict["keywords"],
+            'json_string': to_json_string(c_dict)
+        }
+        add2solr(document2index)
+        if c.id in replaced_collections:
+            remove_older_generations(c.id)
+        if c.id in indexed_hashes:
+            remove_missing_documents(c.id)
+        solr_indexer.collection_finished()
+        if checkpoint_filepath is not None:
+            # recorded once solr acknowledged the documents of the collection (at the latest by the next flush)
+            data = {"collection": c_dict, "state": incremental_state.get(c.id)}
+            solr_indexer.after_acknowledged(lambda: write_checkpoint("collection_" + c_dict["id"], "done", data))
+        report_progress(c.id)
+
+@timed_stage("serialize")
+def get_item_document(item, wkt = None):
+    return get_item_document_from_dict(item.to_dict(), wkt)
+
+def get_item_document_from_dict(c_dict, wkt = None):
+    # the datetimes are rewritten for solr in a copy, the rendered item dict is still used for extent and summaries
+    c_dict = dict(c_dict, properties = dict(c_dict["properties"]))
+    if not c_dict["properties"]["datetime"] == None:
+        date = c_dict["properties"]["datetime"]
+        daterange = date
+    else:
+        #'[2023-01-01T00:00 TO 2023-12-31T23:59Z]'
+        c_dict["properties"]["start_datetime"] = datetime.fromisoformat(c_dict["properties"]["start_datetime"]).strftime("%Y-%m-%dT%H:%M:%SZ")
+        c_dict["properties"]["end_datetime"] = datetime.fromisoformat(c_dict["properties"]["end_datetime"]).strftime("%Y-%m-%dT%H:%M:%SZ")
+        daterange = f"[{c_dict['properties']['start_datetime']} TO {c_dict['properties']['end_datetime']}]"
+        date = None 
+
     document2index = {
-        'uniqueid': "catalog_"+c_dict["id"],
+        "uniqueid": "item_" + c_dict["collection"]+"_"+c_dict["id"],
         'id': c_dict["id"],
         'type': c_dict["type"],
-        'description': c_dict["description"],
-        'json_string': json.dumps(c_dict)
+        'datetime': date,
+        'daterange': daterange,
+        'bbox': wkt if wkt is not None else shapely.geometry.shape(c_dict["geometry"]).wkt,
+        'collection': c_dict["collection"],
+        'json_string': to_json_string(c_dict)
     }
-    add2solr(document2index)
-    solr_conn.commit()
-    solr_conn.optimize()
-
-def index_collections():
-    document2index = None
-    for c in catalog.get_children():
-        if isinstance(c, pystac.Collection) and c.id in to_write_collections:
-
-            index_items(c)
-            c = tidy_up_collection_links(c)
-            c_dict = c.to_dict()
-
-            remove_collection_from_solr(c.id)
+    if c_dict["collection"] in property_fields:
+        document2index.update(get_property_fields(c_dict["properties"], property_fields[c_dict["collection"]]))
+    return document2index
+
+def get_property_fields(properties, names):
+    # Typed dynamic fields of the managed-schema (*_s, *_i, *_d, *_dt, *_b), so the API can filter and facet
+    # on item properties without parsing json_string. Lists and objects are only in json_string
+    fields = {}
+    for name in names:
+        value = properties.get(name)
+        field = re.sub(r"\W", "_", name)
+        if value is None or isinstance(value, (list, dict)):
+            continue
+        date = to_solr_date(value) if isinstance(value, str) and name.endswith("datetime") else None
+        if isinstance(value, bool):
+            fields[field + "_b"] = value
+        elif isinstance(value, numbers.Integral):
+            fields[field + "_i"] = value
+        elif isinstance(value, numbers.Real):
+            fields[field + "_d"] = value
+        elif date is not None:
+            fields[field + "_dt"] = date
+        else:
+            fields[field + "_s"] = str(value)
+    return fields
 
-            print("Add collection to lucene " + c_dict["id"])
-            document2index = {
-                'uniqueid': "collection_"+c_dict["id"],
-                'id': c_dict["id"],
-                'type': c_dict["type"],
-                'datetime': c_dict["extent"]["temporal"]["interval"][0],
-                'bbox': shapely.geometry.box(*c_dict["extent"]["spatial"]["bbox"][0]).wkt,
-                'description': c_dict["description"],
-                'keywords': c_dict["keywords"],
-                'json_string': json.dumps(c_dict)
-            }
-            add2solr(document2index)
-
-            solr_conn.commit()
-            solr_conn.optimize()
+def to_solr_date(value):
+    # datetime columns are iso strings (see compile_converter), naive ones are UTC like the daterange
+    try:
+        dt = to_utc_datetime(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 def index_items(collection):
-    document2index = None
     cnt = 1
+    envelope = collection.id in envelope_collections
+    wkts = item_wkts.pop(collection.id, {})
     for i in collection.get_items(recursive=True):
-        c_dict = i.to_dict()
-        if c_dict["collection"] not in to_write_collections: continue
-
         if isinstance(i, pystac.Item):
             if cnt % 1000 == 0:
-                print(f"{str(cnt)}: Add item to lucene {c_dict['id']} ({c_dict['collection']})")
-
-            if not c_dict["properties"]["datetime"] == None:
-                date = c_dict["properties"]["datetime"]
-                daterange = date
-            else:
-                #'[2023-01-01T00:00 TO 2023-12-31T23:59Z]'
-                c_dict["properties"]["start_datetime"] = datetime.fromisoformat(c_dict["properties"]["start_datetime"]).strftime("%Y-%m-%dT%H:%M:%SZ")
-                c_dict["properties"]["end_datetime"] = datetime.fromisoformat(c_dict["properties"]["end_datetime"]).strftime("%Y-%m-%dT%H:%M:%SZ")
-                daterange = f"[{c_dict['properties']['start_datetime']} TO {c_dict['properties']['end_datetime']}]"
-                date = None 
-
-            document2index = {
-                "uniqueid": "item_" + c_dict["collection"]+"_"+c_dict["id"],
-                'id': c_dict["id"],
-                'type': c_dict["type"],
-                'datetime': date,
-                'daterange': daterange,
-                'bbox': shapely.geometry.shape(c_dict["geometry"]).wkt,
-                'collection': c_dict["collection"],
-                'json_string': json.dumps(c_dict)
-            }
-
-            add2solr(document2index)
+                print(f"{str(cnt)}: Add item to lucene {i.id} ({i.collection_id})")
+                report_progress(collection.id)
+
+            wkt = wkts.get(i.id)
+            if wkt is None:
+                # e.g. collections of a parent catalog read from the API
+                wkt = shapely.geometry.shape(i.geometry).envelope.wkt if envelope else shapely.geometry.shape(i.geometry).wkt
+            add2solr(get_item_document(i, wkt))
             cnt += 1
 
+@timed_stage("select")
+def get_indexed_collection(collection_id):
+    results = solr_conn.search('uniqueid:"%s"' % ("collection_" + collection_id), fl = "json_string")
+    for r in results:
+        return json.loads(r["json_string"])
+    return None
+
+def get_items_query(collection_id):
+    # all items of the collection, the uniqueid prefix alone also matches collections whose id starts
+    # with the same prefix (item_a_* matches the items of a_b)
+    return 'uniqueid:%s* AND collection:"%s"' % ("item_" + collection_id + "_", collection_id)
+
+def iterate_solr(query, fl):
+    # Pages through all documents of the query with a cursor (no deep paging)
+    cursor = "*"
+    while True:
+        results = solr_conn.search(query, fl = fl, sort = "uniqueid asc", rows = 10000, cursorMark = cursor)
+        yield from results
+        if results.nextCursorMark == cursor:
+            return
+        cursor = results.nextCursorMark
+
+@timed_stage("select")
+def get_indexed_item_ids(collection_id):
+    return {r["id"] for r in iterate_solr(get_items_query(collection_id), "id")}
+
+@timed_stage("select")
+def get_indexed_item_hashes(collection_id):
+    # uniqueid -> content hash of all items of the collection (None for documents indexed without hash mode)
+    return {r["uniqueid"]: r.get("content_hash") for r in iterate_solr(get_items_query(collection_id), "uniqueid,content_hash")}
+
 def remove_collection_from_catalog(id,  collection_href):
     catalog.remove_child(id)
     return catalog
 
 def remove_collection_from_solr(collection_id):
-    solr_conn.delete(id = "collection_" + collection_id)
-    solr_conn.delete(q = 'uniqueid:%s*' % "item_" + collection_id )
-    solr_conn.commit()
+    if content_hashes:
+        # hash mode: changed documents replace the old ones (same uniqueid), unchanged ones are skipped
+        # and the documents of items that are gone are deleted by remove_missing_documents
+        indexed_hashes[collection_id] = get_indexed_item_hashes(collection_id)
+        print(f"{len(indexed_hashes[collection_id])} items of {collection_id} in lucene")
+        return
+    if solr_indexer.generation is not None:
+        # generation mode: the old documents stay searchable, the new ones replace them (same uniqueid)
+        # and the remaining ones are deleted by remove_older_generations
+        replaced_collections.add(collection_id)
+        return
+    solr_indexer.delete(id = "collection_" + collection_id)
+    solr_indexer.delete(q = get_items_query(collection_id))
+
+def remove_older_generations(collection_id):
+    # items of the collection that were not written again in this run (e.g. deleted rows),
+    # the delete is sent after the new documents and becomes visible with the same commit
+    solr_indexer.delete(q = '%s AND -generation:"%s"' % (get_items_query(collection_id), solr_indexer.generation))
+
+def remove_missing_documents(collection_id):
+    # hash mode: items in solr that were not generated again in this run (e.g. deleted rows)
+    removed = list(indexed_hashes.pop(collection_id))
+    if len(removed) > 0:
+        print(f"Removing {len(removed)} items from lucene ({collection_id})")
+        solr_indexer.delete(id = removed)
+
+def new_generation():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+# One pooled session for all requests to the STAC API (keep-alive instead of a new connection per request)
+def get_http_session():
+    global http_session
+    if http_session is None:
+        http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = parent_catalog_config.get("api_max_connections", 8))
+        http_session.mount("http://", adapter)
+        http_session.mount("https://", adapter)
+    return http_session
+
+def api_get(href):
+    return get_http_session().get(href, timeout = parent_catalog_config.get("api_timeout", 30))
+
+def get_indexed_collection_ids():
+    # ids of all collections in solr, read with one (paged) query instead of one API request per collection
+    return {r["id"] for r in iterate_solr('type:Collection', "id")}
+
+def request_collection_exists(coll_id):
+    try:
+        response = api_get(parent_catalog_config["href"] + "collections/" + coll_id)
+        return response.status_code == 200
+    except Exception as ex:
+        print(ex)
+        # unknown - treated as existing (see collection_does_not_exist)
+        return True
+
+# Checks the collections not checked yet during this run: by default concurrently against the STAC API
+# (at most api_max_connections requests at a time), with collection_existence_check "solr" by one solr query
+def check_collections_exist(coll_ids):
+    unchecked = [i for i in dict.fromkeys(coll_ids) if i not in existing_collections]
+    if len(unchecked) == 0:
+        return
+    if parent_catalog_config.get("collection_existence_check", "api") == "solr":
+        indexed = get_indexed_collection_ids()
+        existing_collections.update({i: i in indexed for i in unchecked})
+        return
+    with ThreadPoolExecutor(max_workers = parent_catalog_config.get("api_max_connections", 8)) as executor:
+        existing_collections.update(zip(unchecked, executor.map(request_collection_exists, unchecked)))
 
 def get_all_links_to_existing_children(catalog_json):
     existing_collection_links = []
+    check_collections_exist([link["href"].split('/')[-1] for link in catalog_json["links"] if link["rel"] == "child" and link["href"] != None])
     for link in catalog_json["links"]:
         if link["rel"] == "child":
             if link["href"] != None and collection_does_not_exist(link["href"].split('/')[-1]) == False:
@@ -472,21 +2228,15 @@ def get_all_links_to_existing_children(catalog_json):
     return catalog_json
 
 def get_parent_catalog():
-    response = requests.get(parent_catalog_config["href"])
+    response = api_get(parent_catalog_config["href"])
     if response.status_code == 200:
         catalog_json = get_all_links_to_existing_children(response.json())
         return pystac.Catalog.from_dict(catalog_json)
     return None
 
 def collection_does_not_exist(coll_id):
-    try:
-        response = requests.get(parent_catalog_config["href"] + "collections/" + coll_id)
-        if response.status_code != 200:
-            return True
-        return False
-    except Exception as ex:
-        print(ex)
-        return False
+    check_collections_exist([coll_id])
+    return not existing_collections[coll_id]
 
 def add_extensions_to_catalog(catalog, collection_extensions):
     e_list = []
@@ -511,9 +2261,121 @@ class InvalidSTACConfigFile(Exception):
     def __str__(self):
         return self.message
 
-try:
+# PARALLEL GENERATION
+
+def init_worker(catalog_config, db_url, stream, stream_chunk_size, incremental_update, state, pushdown_metadata, export_dir, generation, run_number, checkpoint_file, resume_run, progress, cancel_file, logging_filepath, metrics_filepath, profile_dir, catalog_dict):
+    # Runs once in every worker process: module state is set up again (processes are spawned on windows)
+    global worker_catalog_dict, export_run
+    configure_logging(logging_filepath, filemode = 'a')
+    configure_metrics(metrics_filepath, profile_dir, filemode = 'a')
+    configure_checkpoints(checkpoint_file, resume_run)
+    configure_progress(progress, cancel_file)
+    configure(catalog_config, db_url, stream, stream_chunk_size, incremental_update, state, pushdown_metadata, export_dir)
+    # all workers write the generation of the main process
+    solr_indexer.generation = generation
+    export_run = run_number
+    worker_catalog_dict = catalog_dict
+
+def get_catalog_dict():
+    # what a stand-in catalog needs for the links (root, parent) of collections and items
+    return {
+        "id": catalog.id,
+        "description": catalog.description,
+        "title": catalog.title,
+        "href": catalog.get_self_href()
+    }
+
+# Per collection lifecycle: a collection is built and indexed in a stand-in catalog, then its items are released
+# with it. Only the collection without items (and its incremental state) is returned and added to the catalog,
+# so memory scales with the largest collection instead of the whole catalog.
+# A shared scan group (see group_shared_scans) is built in one pass and then indexed.
+# Used by the worker processes and, one group at a time, by the main process (build_collection_stubs)
+def build_and_index_collections(collection_configs, catalog_dict):
+    global catalog
+    # Stand-in for the parent catalog, so links of items and collections (root, parent) are the same
+    catalog = pystac.Catalog(id=catalog_dict["id"], description=catalog_dict["description"],
+                             title=catalog_dict["title"], href=catalog_dict["href"])
+    if len(collection_configs) > 1:
+        collections = build_shared_scan_collections(collection_configs)
+    else:
+        collections = [build_collection(collection_configs[0])]
+    # indexed through get_children, which also sets the parent link again
+    children = list(catalog.get_children())
+    for c in children:
+        index_collection(c)
+    # the batches still buffered or queued are sent within the last collection, the metrics are finished after that
+    with measure("Collection", children[-1].id):
+        solr_indexer.flush()
+    records = [finish_metrics("Collection", c.id) for c in children]
+    return [(c.to_dict(), incremental_state.get(c.id)) for c in collections], records
+
+def build_collection_stubs(collection_configs):
+    # Main process: the collections are indexed as soon as they are built, the stubs without items are returned
+    global catalog
+    parent_catalog = catalog
+    try:
+        results, _ = build_and_index_collections(collection_configs, get_catalog_dict())
+    finally:
+        catalog = parent_catalog
+    return [pystac.Collection.from_dict(c_dict) for c_dict, _ in results]
+
+def write_collections(collection_configs):
+    # stubs without items stay in the catalog
+    collections = build_collection_stubs(collection_configs)
+    for collection in collections:
+        catalog.add_child(collection, strategy = CustomLayoutStrategy(catalog_func = get_catalog_path, collection_func= get_collection_path, item_func=get_item_path))
+    return collections
+
+def process_collections(collection_configs):
+    # Worker process: creates and indexes one collection or shared scan group
+    return build_and_index_collections(collection_configs, worker_catalog_dict)
+
+def create_collections_in_parallel(collection_groups, logging_filepath, metrics_filepath = None):
+    catalog_dict = get_catalog_dict()
+    with ProcessPoolExecutor(max_workers = workers, initializer = init_worker,
+                             initargs = (parent_catalog_config, url, streaming, chunk_size, incremental, incremental_state, pushdown,
+                                         export_directory, solr_indexer.generation, export_run, checkpoint_filepath, resume,
+                                         progress_output, cancel_filepath, logging_filepath, metrics_filepath, profile_directory, catalog_dict)) as executor:
+        # map keeps the order of the groups
+        for results, records in executor.map(process_collections, collection_groups):
+            # the records are written to the metrics file by the workers, here they are only collected
+            finished_metrics.extend(r for r in records if r is not None)
+            for c_dict, collection_state in results:
+                if collection_state is not None:
+                    incremental_state[c_dict["id"]] = collection_state
+                yield pystac.Collection.from_dict(c_dict)
+
+
+def start_run():
+    # Resets the state of the module for a new run and creates the catalog (or reads it from the STAC API)
+    global catalog, export_run
     catalog = None
-    to_write_collections = []
+    existing_collections.clear()
+    items_indexed.clear()
+    envelope_collections.clear()
+    item_wkts.clear()
+    property_fields.clear()
+    collection_totals.clear()
+    replaced_collections.clear()
+    indexed_hashes.clear()
+    run_metrics.clear()
+    finished_metrics.clear()
+    if not resume:
+        clear_checkpoints()
+    # generation mode replaces rebuilt collections without deleting them first (see remove_collection_from_solr),
+    # a resumed run continues with the generation of the failed run
+    run_checkpoint = read_checkpoint("run")
+    if parent_catalog_config.get("solr_reindex", "delete") != "generation":
+        solr_indexer.generation = None
+    elif run_checkpoint is not None and run_checkpoint["generation"] is not None:
+        solr_indexer.generation = run_checkpoint["generation"]
+    else:
+        solr_indexer.generation = new_generation()
+    write_checkpoint("run", "started", {"generation": solr_indexer.generation})
+    if export_directory is not None:
+        if not resume:
+            remove_exported_files(export_directory)
+        export_run = get_export_run(export_directory)
 
     # read_parent_catalog defines if an existing STAC API will be used and extended or not
     if read_parent_catalog:
@@ -523,21 +2385,47 @@ try:
         catalog = pystac.Catalog(title=parent_catalog_config["title"], id=parent_catalog_config["catalog_id"],
                                 description=parent_catalog_config["catalog_description"],
                                 href = parent_catalog_config["href"])
+    return catalog
+
+def finish_run(state_filepath = None):
+    # Indexes the catalog (the collections are indexed as soon as they are built), the run ends with the commit in index_catalog
+    if not generate_test_node:
+        catalog.resolve_links()
+
+    index_catalog()
+
+    # watermarks are only stored once everything is committed
+    if incremental and state_filepath is not None:
+        write_incremental_state(state_filepath)
+    clear_checkpoints()
+
+def run(config_files, logging_filepath, state_filepath = None, metrics_filepath = None, prometheus_filepath = None):
+    global catalog
+    start = time.perf_counter()
+    success = False
+    try:
+        start_run()
+        build_configs = []
 
-    for current_config in config_files:
-        if "collections" not in current_config.keys():
-            raise InvalidSTACConfigFile(current_config['config_file_name'], faultyKey="collections")
+        collection_configs = []
+        for current_config in config_files:
+            if "collections" not in current_config.keys():
+                raise InvalidSTACConfigFile(current_config['config_file_name'], faultyKey="collections")
+
+            for collection_config in current_config["collections"]:
+                collection_config = fill_config_template(collection_config, current_config).copy()
+                if generate_test_node:
+                    # In Test mode, the collection will be called TEST_xyz (on the copy, the loaded config stays as it is)
+                    collection_config["coll_id"] = "TEST_" + collection_config["coll_id"]
+
+                if collection_config["ignore_collection"]: continue
+                collection_configs.append(collection_config)
+
+        # existence of all collections is checked up front (concurrently, see check_collections_exist)
+        check_collections_exist([c["coll_id"] for c in collection_configs])
 
         # # Iterate over the Collection array in the JSON Config and create a Collection for each one, then add it to the Catalog
-        for collection_config in current_config["collections"]:
-            if generate_test_node:
-                # In Test mode, the collection will be called TEST_xyz
-                collection_config["coll_id"] = "TEST_" + collection_config["coll_id"]
-                
-            coll_id = collection_config["coll_id"]
-            collection_config = fill_config_template(collection_config).copy()
-            
-            if collection_config["ignore_collection"]: continue
+        for collection_config in collection_configs:
             coll_not_existing = collection_does_not_exist(collection_config["coll_id"])
 
             if coll_not_existing == False:
@@ -546,25 +2434,150 @@ try:
                     catalog = remove_collection_from_catalog(collection_config["coll_id"], parent_catalog_config["href"] + "collections/" + collection_config["coll_id"])
 
             if coll_not_existing == True or collection_config["overwrite_existing_collection"]:
-                print(f"Creating new Collection {collection_config['coll_id']}")
-                collection = create_collection(collection_config.copy())
-
-                to_write_collections.append(collection.id)
-
-                catalog.add_child(collection, strategy = CustomLayoutStrategy(catalog_func = get_catalog_path, collection_func= get_collection_path, item_func=get_item_path))
-                catalog = add_extensions_to_catalog(catalog, collection.stac_extensions)
-        
-
-    index_collections()
-
-    if not generate_test_node:
-        catalog.resolve_links()
+                checkpoint = read_checkpoint("collection_" + collection_config["coll_id"])
+                if checkpoint is not None and checkpoint["status"] == "done":
+                    collection = resume_finished_collection(checkpoint)
+                    catalog.add_child(collection, strategy = CustomLayoutStrategy(catalog_func = get_catalog_path, collection_func= get_collection_path, item_func=get_item_path))
+                    catalog = add_extensions_to_catalog(catalog, collection.stac_extensions)
+                    continue
+
+                # created and indexed after the loop, collections sharing a table scan together
+                build_configs.append(collection_config.copy())
+
+        collection_groups = group_shared_scans(build_configs)
+        if workers > 1 and len(collection_groups) > 0:
+            # Collections (and their items) are already indexed by the workers, only the catalog is merged here
+            built_collections = create_collections_in_parallel(collection_groups, logging_filepath, metrics_filepath)
+        else:
+            built_collections = (collection for collection_group in collection_groups for collection in build_collection_stubs(collection_group))
+        collections = {collection.id: collection for collection in built_collections}
+        # a group can contain collections configured apart, the children are added in the order of the configs
+        for collection_config in build_configs:
+            collection = collections[collection_config["coll_id"]]
+            catalog.add_child(collection, strategy = CustomLayoutStrategy(catalog_func = get_catalog_path, collection_func= get_collection_path, item_func=get_item_path))
+            catalog = add_extensions_to_catalog(catalog, collection.stac_extensions)
+
+        finish_run(state_filepath)
+
+        logging.info("SUCCESS")
+        if export_directory is not None:
+            print("Exported catalog to " + export_directory)
+        else:
+            print("Indexed catalog at " + parent_catalog_config["solr"])
+        success = True
         
-    index_catalog()
-    
-    logging.info("SUCCESS")
-    print("Indexed catalog at " + parent_catalog_config["solr"])
-    
-except Exception as e:
-    logging.error(e)
-    print(e)
\ No newline at end of file
+    except Exception as e:
+        logging.error(e)
+        print(e)
+
+    if prometheus_filepath is not None:
+        write_prometheus_textfile(prometheus_filepath, finished_metrics, success, time.perf_counter() - start)
+    return success
+
+
+# LIBRARY API
+
+# Generates a catalog from explicit configuration instead of command line arguments and config files, e.g.
+#   generator = CatalogGenerator(catalog_config, db_url, streaming = True)
+#   generator.build_collection(collection_config)
+#   generator.index()
+# or generator.run(config_files) for a whole run like the command line.
+# The heavy imports and the solr client are set up once and reused by every run of the interpreter.
+# The state of a run is kept in this module, so only one generator can be used at a time per process.
+class CatalogGenerator:
+    def __init__(self, catalog_config, db_url, streaming = False, chunk_size = 5000, workers = 1, incremental = False,
+                 state_filepath = None, pushdown = False, export_directory = None, read_parent_catalog = True, test_mode = False,
+                 logging_filepath = None, metrics_filepath = None, prometheus_filepath = None, profile_directory = None,
+                 checkpoint_filepath = None, resume = False, progress = False, cancel_filepath = None):
+        if resume and checkpoint_filepath is None:
+            raise Exception("resume needs a checkpoint_filepath")
+        self.workers = workers
+        self.read_parent_catalog = read_parent_catalog
+        self.test_mode = test_mode
+        self.state_filepath = state_filepath
+        self.logging_filepath = logging_filepath
+        self.metrics_filepath = metrics_filepath
+        self.prometheus_filepath = prometheus_filepath
+        self.started = False
+        self.apply_options()
+        if logging_filepath is not None:
+            # log of this process (no-op if the application already configured logging) and of the workers
+            configure_logging(logging_filepath, filemode = 'a')
+        configure_metrics(metrics_filepath, profile_directory)
+        configure_checkpoints(checkpoint_filepath, resume)
+        configure_progress(progress, cancel_filepath)
+        state = read_incremental_state(state_filepath) if incremental and state_filepath is not None else {}
+        configure(catalog_config, db_url, streaming, chunk_size, incremental, state, pushdown, export_directory)
+
+    def apply_options(self):
+        global read_parent_catalog, generate_test_node, workers
+        read_parent_catalog = self.read_parent_catalog
+        generate_test_node = self.test_mode
+        workers = self.workers
+
+    def build_collection(self, collection_config):
+        # Builds and indexes one collection (config with the template already applied) in this process,
+        # the collection without items is added to the catalog, which is indexed by index()
+        global catalog
+        if not self.started:
+            self.apply_options()
+            start_run()
+            self.started = True
+        collection = write_collections([collection_config.copy()])[0]
+        catalog = add_extensions_to_catalog(catalog, collection.stac_extensions)
+        return collection
+
+    def index(self):
+        # Indexes the collections built with build_collection and the catalog
+        if not self.started:
+            raise Exception("No collections built")
+        finish_run(self.state_filepath)
+        self.started = False
+        return catalog
+
+    def run(self, config_files):
+        # Whole run over the collection config files (see read_config_files), True if it succeeded
+        self.apply_options()
+        self.started = False
+        return run(config_files, self.logging_filepath, self.state_filepath, self.metrics_filepath, self.prometheus_filepath)
+
+
+def main():
+    # Command line wrapper of CatalogGenerator: arguments and misc_config.json
+    args = parse_arguments()
+
+    # Misc Config read (logging_filepath) 
+    with open(os.path.join(config_directory, "misc_config.json")) as f:
+        misc_config = json.load(f)
+    configure_logging(misc_config["logging_filepath"])
+    if args.resume and misc_config.get("checkpoint_filepath") is None:
+        raise Exception("--resume needs checkpoint_filepath in misc_config.json")
+
+    if args.configs == None:
+        raise Exception("No configs provided")
+
+    config_files = read_config_files(args.configs)
+    generator = CatalogGenerator(read_parent_catalog_config(args.testMode), read_db_url(),
+                                 streaming = args.streaming,
+                                 chunk_size = args.chunkSize,
+                                 workers = args.workers,
+                                 incremental = args.incremental,
+                                 state_filepath = misc_config.get("incremental_state_filepath", os.path.join(directory, "incremental_state.json")),
+                                 pushdown = args.pushdown,
+                                 export_directory = args.export,
+                                 read_parent_catalog = args.readParentCatalog,
+                                 test_mode = args.testMode,
+                                 logging_filepath = misc_config["logging_filepath"],
+                                 metrics_filepath = misc_config.get("metrics_filepath", os.path.splitext(misc_config["logging_filepath"])[0] + "_metrics.jsonl"),
+                                 prometheus_filepath = misc_config.get("prometheus_filepath"),
+                                 profile_directory = misc_config.get("profile_directory", os.path.join(os.path.dirname(misc_config["logging_filepath"]), "profiles")) if args.profile else None,
+                                 checkpoint_filepath = misc_config.get("checkpoint_filepath"),
+                                 resume = args.resume,
+                                 progress = args.progress,
+                                 cancel_filepath = args.cancelFile)
+    if not generator.run(config_files):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
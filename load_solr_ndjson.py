@@ -0,0 +1,102 @@
+import json, argparse
+import os, glob, gzip
+import requests
+from create_dynamic_catalog import strtobool
+
+# Loads the NDJSON files written by create_dynamic_catalog.py --export into solr.
+# Every request streams up to chunk_size lines of a file as one json update command object
+# ({"add": {"doc": ...}, "add": {"doc": ...}, "delete": {...}, ...}) with chunked transfer encoding,
+# so neither the files nor a request are held in memory. Solr applies the commands in order.
+
+directory = os.path.dirname(os.path.realpath(__file__))
+config_directory = os.path.join(directory, "config")
+
+chunk_size = 10000
+timeout = 600
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Load exported NDJSON documents into solr')
+    parser.add_argument('--directory', required=True, help='Directory with the exported documents-*.ndjson[.gz] files')
+    parser.add_argument('--solr', default=None, help='URL of the solr core (default: solr of empty_parent_catalog.json)')
+    parser.add_argument('--chunkSize', type=int, default=chunk_size, help='Number of lines per update request')
+    parser.add_argument('--commit', type=lambda x: bool(strtobool(x)), default=True, help='Hard commit after all files are loaded')
+    parser.add_argument('--optimize', type=lambda x: bool(strtobool(x)), default=False, help='Optimize the index after the commit')
+    return parser.parse_args()
+
+def read_solr_url():
+    with open(os.path.join(config_directory, "collection_config_files", "empty_parent_catalog.json"), mode="r", encoding="utf-8") as file:
+        return json.load(file)["solr"]
+
+def open_export_file(filepath):
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, "rt", encoding="utf-8")
+    return open(filepath, mode="r", encoding="utf-8")
+
+def read_lines(file):
+    # complete lines only: the last shard of a failed run can end in the middle of a line (or without gzip trailer),
+    # its documents up to the last checkpoint are complete
+    try:
+        for line in file:
+            if line.endswith("\n"):
+                yield line
+    except EOFError:
+        return
+
+def to_update_command(line):
+    # documents are added, {"delete": ...} lines are passed on as they are
+    if line.startswith('{"delete":'):
+        return '"delete":' + line[len('{"delete":'):-1]
+    return '"add":{"doc":' + line + '}'
+
+def get_request_bodies(lines, lines_per_request):
+    # yields one generator per request, every generator streams the next lines_per_request lines
+    lines = (l.rstrip("\n") for l in lines if l.strip())
+    for first in lines:
+        def body(first = first):
+            yield b"{" + to_update_command(first).encode("utf-8")
+            for _, line in zip(range(lines_per_request - 1), lines):
+                yield b"," + to_update_command(line).encode("utf-8")
+            yield b"}"
+        yield body()
+
+def post(session, update_url, data):
+    response = session.post(update_url, data = data, params = {"wt": "json"},
+                            headers = {"Content-Type": "application/json"}, timeout = timeout)
+    response.raise_for_status()
+
+def load_file(session, update_url, filepath, lines_per_request):
+    requests_sent = 0
+    with open_export_file(filepath) as file:
+        for body in get_request_bodies(read_lines(file), lines_per_request):
+            post(session, update_url, body)
+            requests_sent += 1
+    return requests_sent
+
+def load(export_directory, solr_url, lines_per_request = chunk_size, commit = True, optimize = False):
+    # documents-<run>-<pid>-<shard>: the zero-padded run and shard numbers keep the order in which they were written
+    # (a resumed run after the failed one), the shards of different processes hold different collections
+    filepaths = sorted(glob.glob(os.path.join(export_directory, "documents-*.ndjson*")))
+    if len(filepaths) == 0:
+        raise Exception("No exported files found in " + export_directory)
+
+    update_url = solr_url.rstrip("/") + "/update"
+    with requests.Session() as session:
+        for filepath in filepaths:
+            requests_sent = load_file(session, update_url, filepath, lines_per_request)
+            print(f"Loaded {os.path.basename(filepath)} ({requests_sent} requests)")
+        if commit:
+            post(session, update_url, '{"commit":{}}')
+        if optimize:
+            post(session, update_url, '{"optimize":{}}')
+    print("Loaded catalog into " + solr_url)
+
+
+def main():
+    args = parse_arguments()
+    solr_url = args.solr if args.solr is not None else read_solr_url()
+    load(args.directory, solr_url, args.chunkSize, args.commit, args.optimize)
+
+
+if __name__ == "__main__":
+    main()
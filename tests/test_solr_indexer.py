@@ -0,0 +1,161 @@
+import os, sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import create_dynamic_catalog as cdc
+
+cdc.import_dependencies()
+pysolr = cdc.pysolr
+
+
+# Stand-in for pysolr.Solr: records the batches, fails the first requests and takes latency seconds per request
+class StubSolr:
+    def __init__(self, failures = 0, latency = 0.0, fail_always = False):
+        self.failures = failures
+        self.latency = latency
+        self.fail_always = fail_always
+        self.requests = 0
+        self.batches = []
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        self.release.set()
+
+    def add(self, docs, commit = False, commitWithin = None):
+        self.release.wait()
+        time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+            if self.fail_always or self.failures > 0:
+                self.failures -= 1
+                raise pysolr.SolrError("Solr responded with an error (HTTP 503): [Reason: busy]")
+            self.batches.append([d["id"] for d in docs])
+
+    def delete(self, commit = False, **kwargs):
+        pass
+
+    def commit(self, **kwargs):
+        pass
+
+
+def add_documents(indexer, n, start = 0):
+    for i in range(start, start + n):
+        indexer.add({"id": str(i)})
+
+
+def indexed_ids(solr):
+    return sorted(int(i) for batch in solr.batches for i in batch)
+
+
+def test_retry_sends_the_batch_after_failures():
+    solr = StubSolr(failures = 2)
+    indexer = cdc.SolrIndexer(solr, batch_size = 10, retries = 3, retry_backoff = 0)
+    add_documents(indexer, 10)
+    assert solr.requests == 3
+    assert indexed_ids(solr) == list(range(10))
+    # every failure halves the batch size (10 -> 5 -> 2), the fast request at the end grows it by one
+    assert indexer.batch_size == 3
+
+
+def test_retry_raises_after_the_last_retry():
+    solr = StubSolr(fail_always = True)
+    indexer = cdc.SolrIndexer(solr, batch_size = 10, retries = 2, retry_backoff = 0)
+    with pytest.raises(pysolr.SolrError):
+        add_documents(indexer, 10)
+    assert solr.requests == 3
+    assert indexer.batch_size == indexer.min_batch_size
+
+
+def test_writer_error_is_raised_in_the_generating_thread():
+    solr = StubSolr(fail_always = True)
+    indexer = cdc.SolrIndexer(solr, batch_size = 10, writers = 2, retries = 1, retry_backoff = 0)
+    with pytest.raises(pysolr.SolrError):
+        add_documents(indexer, 10)
+        indexer.flush()
+
+
+def test_batch_size_grows_while_requests_are_fast():
+    solr = StubSolr()
+    indexer = cdc.SolrIndexer(solr, batch_size = 8, max_batch_size = 12, target_latency = 10.0)
+    add_documents(indexer, 8)
+    assert indexer.batch_size == 10
+    add_documents(indexer, 10, 8)
+    assert indexer.batch_size == 12
+    add_documents(indexer, 12, 18)
+    assert indexer.batch_size == 12
+
+
+def test_batch_size_is_halved_when_requests_are_slow():
+    solr = StubSolr(latency = 0.02)
+    indexer = cdc.SolrIndexer(solr, batch_size = 40, target_latency = 0.01)
+    add_documents(indexer, 40)
+    assert indexer.batch_size == 20
+    add_documents(indexer, 20, 40)
+    assert indexer.batch_size == 10
+    # partial batches (flush) do not change the batch size
+    add_documents(indexer, 3, 60)
+    indexer.flush()
+    assert indexer.batch_size == 10
+    add_documents(indexer, 50, 63)
+    assert indexer.batch_size == indexer.min_batch_size
+
+
+def test_concurrent_writers_send_every_document():
+    solr = StubSolr(latency = 0.001)
+    indexer = cdc.SolrIndexer(solr, batch_size = 7, writers = 4, target_latency = 10.0)
+    add_documents(indexer, 1000)
+    indexer.flush()
+    assert indexed_ids(solr) == list(range(1000))
+    assert indexer.min_batch_size <= indexer.batch_size <= indexer.max_batch_size
+
+
+def test_after_acknowledged_waits_for_the_batches_without_flush():
+    solr = StubSolr()
+    solr.release.clear()
+    indexer = cdc.SolrIndexer(solr, batch_size = 5, writers = 2)
+    calls = []
+    add_documents(indexer, 10)
+    indexer.after_acknowledged(lambda: calls.append("first"))
+    add_documents(indexer, 3, 10)
+    indexer.after_acknowledged(lambda: calls.append("second"))
+    # the writers are still blocked, the generating thread goes on
+    assert calls == []
+    solr.release.set()
+    deadline = time.time() + 5
+    while indexer.acknowledged < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    # callbacks run in the generating thread with the next batch, the documents of "second" are still buffered
+    indexer.run_callbacks()
+    assert calls == ["first"]
+    indexer.flush()
+    assert calls == ["first", "second"]
+
+
+def test_after_acknowledged_is_not_called_for_a_failed_batch():
+    solr = StubSolr(fail_always = True)
+    indexer = cdc.SolrIndexer(solr, batch_size = 5, writers = 2, retries = 0)
+    calls = []
+    with pytest.raises(pysolr.SolrError):
+        add_documents(indexer, 5)
+        indexer.after_acknowledged(lambda: calls.append("checkpoint"))
+        indexer.flush()
+    assert calls == []
+
+
+def test_commit_stops_the_writer_threads():
+    threads = threading.active_count()
+    solr = StubSolr()
+    indexer = cdc.SolrIndexer(solr, batch_size = 5, writers = 3)
+    add_documents(indexer, 20)
+    assert threading.active_count() == threads + 3
+    indexer.commit()
+    assert threading.active_count() == threads
+    assert indexed_ids(solr) == list(range(20))
+    # the indexer can be used again after the commit
+    add_documents(indexer, 5, 20)
+    indexer.flush()
+    indexer.close()
+    assert threading.active_count() == threads
+    assert indexed_ids(solr) == list(range(25))
@@ -0,0 +1,157 @@
+import os, sys
+import json
+import random
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import create_dynamic_catalog as cdc
+import benchmark_create_dynamic_catalog as benchmark
+from test_solr_indexer import StubSolr
+
+cdc.import_dependencies()
+pysolr = cdc.pysolr
+
+
+# StubSolr keeping the documents (by uniqueid), fails every request after fail_after requests
+class DocumentSolr(StubSolr):
+    def __init__(self, fail_after = None):
+        super().__init__()
+        self.fail_after = fail_after
+        self.documents = {}
+
+    def add(self, docs, commit = False, commitWithin = None):
+        if self.fail_after is not None and self.requests >= self.fail_after:
+            self.fail_always = True
+        super().add(docs, commit, commitWithin)
+        self.documents.update((d["uniqueid"], d) for d in docs)
+
+
+# Synthetic table of the benchmark (500 rows in coll 0, 1, 2), streamed in chunks of 70 rows
+@pytest.fixture
+def db_filepath(tmp_path, monkeypatch):
+    random.seed(1)
+    db_filepath = str(tmp_path / "benchmark.sqlite")
+    benchmark.create_table(db_filepath, 500, 3, 5)
+    monkeypatch.setattr(cdc, "create_engine", benchmark.create_sqlite_engine)
+    cdc.read_parent_catalog = False
+    cdc.configure_checkpoints(None)
+    cdc.configure(benchmark.get_parent_catalog_config(8983), "sqlite:///" + db_filepath, True, 70)
+    yield db_filepath
+    cdc.configure_checkpoints(None)
+
+
+def get_collection_configs(wheres):
+    config_file = benchmark.get_collection_config_file(len(wheres))
+    configs = []
+    for collection_config, where in zip(config_file["collections"], wheres):
+        collection_config["coll_tabelle_where"] = where
+        configs.append(cdc.fill_config_template(collection_config, config_file).copy())
+    return configs
+
+
+def select_ids(db_filepath, where):
+    with sqlite3.connect(db_filepath) as conn:
+        return sorted(r[0] for r in conn.execute("SELECT image_id FROM images WHERE " + where))
+
+
+def start_run(solr):
+    cdc.start_run()
+    cdc.solr_indexer = cdc.SolrIndexer(solr, batch_size = 50, retries = 0)
+
+
+def build_and_index(collection_configs):
+    results, _ = cdc.build_and_index_collections(collection_configs, cdc.get_catalog_dict())
+    return [c_dict["id"] for c_dict, _ in results]
+
+
+def test_shared_scan_routes_every_row_to_all_matching_collections(db_filepath):
+    wheres = ["coll = 0", "coll = 1", "coll IN (0, 2)", "sensor = 'UCE'", "coll = 9"]
+    chunks = list(cdc.stream_shared_scan(get_collection_configs(wheres)))
+    assert len(chunks) > 1
+    assert all(len(chunk) == len(wheres) for chunk in chunks)
+    for i, where in enumerate(wheres):
+        assert sorted(r["id"] for chunk in chunks for r in chunk[i]) == select_ids(db_filepath, where)
+    assert select_ids(db_filepath, "coll = 9") == []
+
+
+def test_shared_scan_indexes_the_documents_of_separate_scans(db_filepath):
+    configs = get_collection_configs(["coll = 0", "coll IN (0, 1)", "sensor = 'UCE'"])
+    assert cdc.group_shared_scans(configs) == [configs]
+    shared = DocumentSolr()
+    start_run(shared)
+    assert build_and_index(configs) == ["benchmark_0", "benchmark_1", "benchmark_2"]
+
+    separate = DocumentSolr()
+    start_run(separate)
+    for collection_config in configs:
+        build_and_index([collection_config])
+    assert len(shared.documents) == sum(len(select_ids(db_filepath, c["coll_tabelle_where"])) for c in configs) + len(configs)
+    assert shared.documents == separate.documents
+
+
+def test_shared_scan_fails_for_a_collection_without_rows(db_filepath):
+    start_run(DocumentSolr())
+    with pytest.raises(Exception, match = "No data in db"):
+        build_and_index(get_collection_configs(["coll = 0", "coll = 9"]))
+
+
+def test_collections_with_the_same_scan_are_grouped_across_other_collections(db_filepath):
+    configs = get_collection_configs(["coll = 0", "coll = 1", "coll = 2", "coll = 1"])
+    configs[1]["coll_geometry_precision"] = 3
+    assert cdc.group_shared_scans(configs) == [[configs[0], configs[2], configs[3]], [configs[1]]]
+
+
+@pytest.mark.parametrize("projection_geometry, asset_description", [(True, "Orthophoto"), (False, None)])
+def test_item_renderer_writes_the_item_json_of_pystac(db_filepath, projection_geometry, asset_description):
+    collection_config = get_collection_configs(["coll = 1"])[0]
+    collection_config["coll_projection_geometry"] = projection_geometry
+    collection_config["assets"][0]["description"] = asset_description
+    start_run(DocumentSolr())
+    chunk = next(cdc.stream_from_db(collection_config))
+    collection = cdc.start_stream_collection(collection_config, chunk[0])
+    render = cdc.get_item_renderer(collection, collection_config, chunk)
+    assert render is not None
+    items = cdc.get_items({r["id"]: r for r in chunk}, collection_config)
+    for row, item in zip(chunk, items):
+        expected = json.dumps(cdc.link_item(item, collection).to_dict())
+        assert json.dumps(render(row)) == expected
+
+
+def test_resume_continues_after_the_last_chunk_checkpoint(db_filepath, tmp_path):
+    collection_config = get_collection_configs(["coll = 2"])[0]
+    reference = DocumentSolr()
+    start_run(reference)
+    build_and_index([collection_config])
+
+    checkpoint_filepath = str(tmp_path / "checkpoints.sqlite")
+    cdc.configure_checkpoints(checkpoint_filepath)
+    failed = DocumentSolr(fail_after = 2)
+    start_run(failed)
+    with pytest.raises(pysolr.SolrError):
+        build_and_index([collection_config])
+    with sqlite3.connect(checkpoint_filepath) as conn:
+        status, data = conn.execute("SELECT status, data FROM checkpoints WHERE key = 'collection_benchmark_0'").fetchone()
+    assert status == "indexing"
+    assert json.loads(data)["rows"] == 70
+
+    cdc.configure_checkpoints(checkpoint_filepath, resume_run = True)
+    resumed = DocumentSolr()
+    start_run(resumed)
+    build_and_index([collection_config])
+    # the rows of the checkpointed chunk are not sent again, extent and summaries continue from the checkpoint
+    assert len(resumed.documents) == len(reference.documents) - 70
+    assert dict(failed.documents, **resumed.documents) == reference.documents
+
+
+def test_partitions_are_read_by_worker_processes(db_filepath):
+    collection_config = get_collection_configs(["coll IN (0, 1)"])[0]
+    rows = {r["id"]: r for chunk in cdc.stream_from_db(collection_config) for r in chunk}
+    collection_config["coll_partitions"] = 3
+    chunks = list(cdc.stream_from_db(collection_config))
+    assert len(chunks) == 5
+    assert all(len(chunk) <= 70 for chunk in chunks)
+    partitioned = {r["id"]: r for chunk in chunks for r in chunk}
+    assert sorted(partitioned) == select_ids(db_filepath, "coll IN (0, 1)")
+    assert {k: dict(r) for k, r in partitioned.items()} == {k: dict(r) for k, r in rows.items()}